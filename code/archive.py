@@ -0,0 +1,163 @@
+"""COMP6202 - Evolution of Complexity
+Holds the on-disk run archive format. A run archive is a folder holding a
+small JSON metadata header and memory-mapped NumPy arrays of every
+generation's trait unitations and subjective scores:
+
+    meta.json       Seed, config, generator dimensions and the stopping
+                    criterion that ended the run, if any.
+    values_a.npy    Unitations of population A, (generations, n, traits).
+    values_b.npy    Unitations of population B, (generations, n, traits).
+    subj.npy        Average subjective scores of A and B, (generations, 2).
+"""
+
+__authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
+
+import json
+import os
+import numpy as np
+
+from typing import List
+
+from history import Sink
+from representation import ArrayPopulation
+
+META_FILE = "meta.json"
+VALUES_A_FILE = "values_a.npy"
+VALUES_B_FILE = "values_b.npy"
+SUBJ_FILE = "subj.npy"
+
+
+class ArchiveSink(Sink):
+    def __init__(
+        self,
+        path: str,
+        generations: int,
+        n: int,
+        total_bits: List[int],
+        metadata: dict = None,
+    ):
+        """Sink that writes a run into a run archive, all arrays are
+        preallocated for the full run.
+
+        Args:
+            path (str): Folder to create the archive in.
+            generations (int): Number of generations the run is for.
+            n (int): Population size.
+            total_bits (List[int]): Total bits of each trait.
+            metadata (dict, optional): Extra JSON serialisable metadata e.g.
+                the seed and config. Defaults to None.
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.path = path
+        self.meta = {
+            "n": n,
+            "generations": generations,
+            "total_bits": [int(b) for b in total_bits],
+            "recorded": 0,
+        }
+        self.meta.update(metadata or {})
+        shape = (generations + 1, n, len(total_bits))
+        self.values_a = self._open(VALUES_A_FILE, shape, ArrayPopulation.DTYPE)
+        self.values_b = self._open(VALUES_B_FILE, shape, ArrayPopulation.DTYPE)
+        self.subj = self._open(SUBJ_FILE, (generations + 1, 2), np.float64)
+
+    @classmethod
+    def open(cls, path: str) -> "ArchiveSink":
+        """Reopen an archive to continue writing to it, e.g. when resuming a
+        run from a checkpoint. Generations recorded after the checkpoint are
+        overwritten as the run is repeated from there.
+
+        Args:
+            path (str): Folder of the archive.
+
+        Returns:
+            ArchiveSink: Sink writing to the existing archive.
+        """
+        sink = cls.__new__(cls)
+        sink.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            sink.meta = json.load(f)
+        sink.values_a = sink._open(VALUES_A_FILE, mode="r+")
+        sink.values_b = sink._open(VALUES_B_FILE, mode="r+")
+        sink.subj = sink._open(SUBJ_FILE, mode="r+")
+        return sink
+
+    def _open(
+        self,
+        name: str,
+        shape: tuple = None,
+        dtype: np.dtype = None,
+        mode: str = "w+",
+    ) -> np.memmap:
+        return np.lib.format.open_memmap(
+            os.path.join(self.path, name), mode=mode, dtype=dtype, shape=shape
+        )
+
+    def record(self, g, pop_a, pop_b, subj_a, subj_b):
+        self.values_a[g] = pop_a.values
+        self.values_b[g] = pop_b.values
+        self.subj[g] = (subj_a, subj_b)
+        self.meta["recorded"] = g + 1
+
+    def stopped(self, criterion, g):
+        self.meta["stopped"] = {"criterion": criterion, "generation": g}
+
+    def flush(self):
+        for arr in (self.values_a, self.values_b, self.subj):
+            arr.flush()
+        with open(os.path.join(self.path, META_FILE), "w") as f:
+            json.dump(self.meta, f, indent=2)
+
+    def close(self):
+        self.flush()
+
+
+class RunArchive:
+    def __init__(self, path: str):
+        """Lazily open a run archive, arrays are memory-mapped read only so
+        only the generations that are accessed are read from disk. The
+        archive can be plotted directly.
+
+        Args:
+            path (str): Folder of the archive.
+        """
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        recorded = self.meta["recorded"]
+        self.total_bits = np.array(self.meta["total_bits"])
+        self.values_a = self._load(VALUES_A_FILE)[:recorded]
+        self.values_b = self._load(VALUES_B_FILE)[:recorded]
+        subj = self._load(SUBJ_FILE)[:recorded]
+        self.subj_a = subj[:, 0]
+        self.subj_b = subj[:, 1]
+        self.gens = range(recorded)
+        self.pops_a = PopulationSequence(self.values_a, self.total_bits)
+        self.pops_b = PopulationSequence(self.values_b, self.total_bits)
+
+    def _load(self, name: str) -> np.memmap:
+        return np.load(os.path.join(self.path, name), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.gens)
+
+
+class PopulationSequence:
+    """Read only sequence of array populations backed by a single
+    (generations, n, traits) array.
+    """
+
+    def __init__(self, values: np.ndarray, total_bits: np.ndarray):
+        self.values = values
+        self.total_bits = total_bits
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, g: int) -> ArrayPopulation:
+        return ArrayPopulation(self.values[g], self.total_bits)
+
+    def __iter__(self):
+        for g in range(len(self)):
+            yield self[g]
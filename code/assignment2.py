@@ -15,23 +15,11 @@ import os
 import cv2 as cv
 import matplotlib.pyplot as plt
 
-from coevolution import Coevolution, HOF
-from representation import Generator
-from mutation import Mutator
-from scoring import Scorer, F0Scorer
-from selection import (
-    Selector,
-    VirulenceSelector,
-    FitnessProportionateSelection,
-    StochasticUniversalSampling,
-    TournamentSelection,
-)
-
-from plot import Plotter
-from utils import seed_random
-
-
-def run():
+from experiments import ExperimentConfig, ResultCache
+from plot import Plotter, render_many
+
+
+def run(runs: int = 1, processes: int = None, headless: bool = False):
     plotter = Plotter(show_avgs=True, plot_elites=False)
     fig_1 = 1
     fig_2 = 1
@@ -43,130 +31,155 @@ def run():
     use_fixed_seed = 1
     enable_hof = 0
     enable_virulence = 0
+    enable_stopping = 0
     generations = 600
 
     export_folder = "../report/plots/"
-    generator_a = Generator(100, 1)
-    generator_b = Generator(10, 10)
-    generator_c = Generator(50, 2)
-    mutator = Mutator(mutation_rate=0.005, bit_flip=False)
-    selector = FitnessProportionateSelection()
+    cache = ResultCache("../cache/")
+    generator_a = (100, 1)
+    generator_b = (10, 10)
+    generator_c = (50, 2)
+    mutator = {"type": "mutator", "mutation_rate": 0.005, "bit_flip": False}
+    selector = {"type": "fps"}
     n = 25
 
     if enable_hof:
-        hof = HOF(scorer=Scorer(sample_size=10), size=50)
+        hof = {
+            "type": "hof",
+            "scorer": {"type": "scorer", "sample_size": 10},
+            "size": 50,
+        }
     else:
         hof = None
 
+    # End runs early once disengaged or converged
+    if enable_stopping:
+        stopping = [
+            {"type": "disengagement", "window": 100},
+            {"type": "convergence", "window": 200},
+        ]
+    else:
+        stopping = None
+
     # Wrap selector with virulence handling
     if enable_virulence:
-        selector = VirulenceSelector(selector, 0.75, normalise=True)
+        selector = {
+            "type": "virulence",
+            "selector": selector,
+            "lamb": 0.75,
+            "normalise": True,
+        }
+
+    def fixed(seed: int) -> int:
+        return seed if use_fixed_seed else None
 
+    cfgs = []
     if fig_1:
-        seed = seed_random(0, use_fixed_seed)
-        description = "Figure 1 : [Seed {}]".format(seed)
-        print(description)
-        pop_a = generator_a.population(n, 0)
-        pop_b = generator_a.population(n, 100)
-        executor = Coevolution(scorer=F0Scorer(), selector=selector)
-        executor.run(pop_a, pop_b, generations)
-        plotter.make_plot(
-            executor,
-            fig_name=description,
-            export_path=os.path.join(export_folder, "fig1.png"),
-        )
+        cfgs += [
+            ExperimentConfig(
+                "Figure 1",
+                *generator_a,
+                generations,
+                n=n,
+                init_b=100,
+                seed=fixed(0),
+                export_name="fig1.png",
+                scorer={"type": "f0_scorer"},
+                selector=selector,
+            )
+        ]
 
     if fig_2:
-        seed = seed_random(1, use_fixed_seed)
-        description = "Figure 2 : [Seed {}]".format(seed)
-        print(description)
-        pop_a = generator_a.population(n, 0)
-        pop_b = generator_a.population(n, 0)
-        executor = Coevolution(mutator=mutator, hof=hof, selector=selector)
-        executor.run(pop_a, pop_b, generations)
-        plotter.make_plot(
-            executor,
-            fig_name=description,
-            export_path=os.path.join(export_folder, "fig2.png"),
-        )
+        cfgs += [
+            ExperimentConfig(
+                "Figure 2",
+                *generator_a,
+                generations,
+                n=n,
+                seed=fixed(1),
+                export_name="fig2.png",
+                mutator=mutator,
+                hof=hof,
+                stopping=stopping,
+                selector=selector,
+            )
+        ]
 
     if fig_3:
-        seed = seed_random(8486058433753192762, use_fixed_seed)
-        description = "Figure 3 : [Seed {}]".format(seed)
-        print(description)
-        pop_a = generator_a.population(n, 0)
-        pop_b = generator_a.population(n, 0)
-        executor = Coevolution(
-            mutator=mutator, scorer=Scorer(sample_size=1), hof=hof, selector=selector
-        )
-        executor.run(pop_a, pop_b, generations)
-        plotter.make_plot(
-            executor,
-            fig_name=description,
-            export_path=os.path.join(export_folder, "fig3.png"),
-        )
+        cfgs += [
+            ExperimentConfig(
+                "Figure 3",
+                *generator_a,
+                generations,
+                n=n,
+                seed=fixed(8486058433753192762),
+                export_name="fig3.png",
+                mutator=mutator,
+                scorer={"type": "scorer", "sample_size": 1},
+                hof=hof,
+                stopping=stopping,
+                selector=selector,
+            )
+        ]
 
     if fig_4:
-        seed = seed_random(59759543964706904, use_fixed_seed)
-        description = "Figure 4 : [Seed {}]".format(seed)
-        print(description)
-        pop_a = generator_b.population(n, 0)
-        pop_b = generator_b.population(n, 0)
-        executor = Coevolution(mutator=mutator, hof=hof, selector=selector)
-        executor.run(pop_a, pop_b, generations)
-        plotter.make_plot(
-            executor,
-            fig_name=description,
-            export_path=os.path.join(export_folder, "fig4.png"),
-        )
+        cfgs += [
+            ExperimentConfig(
+                "Figure 4",
+                *generator_b,
+                generations,
+                n=n,
+                seed=fixed(59759543964706904),
+                export_name="fig4.png",
+                mutator=mutator,
+                hof=hof,
+                stopping=stopping,
+                selector=selector,
+            )
+        ]
 
     if fig_5:
-        seed = seed_random(5706501168717675099, use_fixed_seed)
-        description = "Figure 5 : [Seed {}]".format(seed)
-        print(description)
-        pop_a = generator_c.population(n, 0)
-        pop_b = generator_c.population(n, 0)
-        executor = Coevolution(
-            mutator=mutator,
-            scorer=Scorer(intransitive=True),
-            hof=hof,
-            selector=selector,
-        )
-        executor.run(pop_a, pop_b, generations)
-        plotter.make_plot(
-            executor,
-            fig_name=description,
-            export_path=os.path.join(export_folder, "fig5.png"),
-        )
+        cfgs += [
+            ExperimentConfig(
+                "Figure 5",
+                *generator_c,
+                generations,
+                n=n,
+                seed=fixed(5706501168717675099),
+                export_name="fig5.png",
+                mutator=mutator,
+                scorer={"type": "scorer", "intransitive": True},
+                hof=hof,
+                stopping=stopping,
+                selector=selector,
+            )
+        ]
 
     if extension:
-        hof = HOF(scorer=Scorer(sample_size=10), size=50)
-        generations = 1200
-        fp_selector = FitnessProportionateSelection()
-        sus_selector = StochasticUniversalSampling()
-        t_selector = TournamentSelection(3)
+        hof = {
+            "type": "hof",
+            "scorer": {"type": "scorer", "sample_size": 10},
+            "size": 50,
+        }
+        fp_selector = {"type": "fps"}
+        sus_selector = {"type": "sus"}
+        t_selector = {"type": "tournament", "n": 3}
+
+        def virulence(selector: dict, lamb: float) -> dict:
+            return {"type": "virulence", "selector": selector, "lamb": lamb}
+
         ext_cfgs = []
         ext_cfgs += [
-            (
-                "Virulence [0.5]",
-                "fig_5_v0.5.png",
-                VirulenceSelector(fp_selector, 0.5),
-                False,
-            )
+            ("Virulence [0.5]", "fig_5_v0.5.png", virulence(fp_selector, 0.5), False)
         ]
         ext_cfgs += [
-            (
-                "Virulence [0.75]",
-                "fig_5_v0.75.png",
-                VirulenceSelector(fp_selector, 0.75),
-                False,
-            )
+            ("Virulence [0.75]", "fig_5_v0.75.png", virulence(fp_selector, 0.75), False)
         ]
         ext_cfgs += [
             (
                 "Virulence [0.75] + SUS",
                 "fig_5_v0.75_sus.png",
-                VirulenceSelector(sus_selector, 0.75),
+                virulence(sus_selector, 0.75),
                 False,
             )
         ]
@@ -174,7 +187,7 @@ def run():
             (
                 "Virulence [0.75] + TS",
                 "fig_5_v0.75_ts.png",
-                VirulenceSelector(t_selector, 0.75),
+                virulence(t_selector, 0.75),
                 False,
             )
         ]
@@ -182,7 +195,7 @@ def run():
             (
                 "Virulence [0.75] + SUS + HOF",
                 "fig_5_v0.75_sus_hof.png",
-                VirulenceSelector(sus_selector, 0.75),
+                virulence(sus_selector, 0.75),
                 True,
             )
         ]
@@ -190,37 +203,56 @@ def run():
             (
                 "Virulence [0.75] + HOF",
                 "fig_5_v0.75_hof.png",
-                VirulenceSelector(fp_selector, 0.75),
+                virulence(fp_selector, 0.75),
                 True,
             )
         ]
         ext_cfgs += [("HOF", "fig_5_hof.png", fp_selector, True)]
         for (cfg_txt, export_name, selector, use_hof) in ext_cfgs:
-            seed = seed_random(8985012493578745191, use_fixed_seed)
-            description = "Figure 5 - {} : [Seed {}]".format(cfg_txt, seed)
-            print(description)
-            pop_a = generator_c.population(n, 0)
-            pop_b = generator_c.population(n, 0)
-            executor = Coevolution(
-                mutator=mutator,
-                scorer=Scorer(intransitive=True),
-                selector=selector,
-                hof=hof if use_hof else None,
-            )
-            executor.run(pop_a, pop_b, generations)
-            plotter.make_plot(
-                executor,
-                fig_name=description,
-                export_path=os.path.join(export_folder, export_name),
+            cfgs += [
+                ExperimentConfig(
+                    "Figure 5 - {}".format(cfg_txt),
+                    *generator_c,
+                    1200,
+                    n=n,
+                    seed=fixed(8985012493578745191),
+                    export_name=export_name,
+                    mutator=mutator,
+                    scorer={"type": "scorer", "intransitive": True},
+                    selector=selector,
+                    hof=hof if use_hof else None,
+                    stopping=stopping,
+                )
+            ]
+
+    # Simulate uncached runs in parallel, plot here or render in parallel if
+    # headless
+    cfgs = [c for cfg in cfgs for c in cfg.sweep(runs)]
+    renders = []
+    for (cfg, seed, archive) in cache.run(cfgs, processes=processes):
+        description = cfg.describe(seed)
+        print(description)
+        if "stopped" in archive.meta:
+            stopped = archive.meta["stopped"]
+            print(
+                "  Stopped by {criterion} at generation {generation}".format(**stopped)
             )
+        export_path = os.path.join(export_folder, cfg.export_name)
+        if headless:
+            renders += [(archive, export_path)]
+        else:
+            plotter.make_plot(archive, fig_name=description, export_path=export_path)
+    if renders:
+        render_many(renders, plotter=plotter, processes=processes)
 
 
-def run_loop(repeat: bool = False, executions: int = 1):
+def run_loop(repeat: bool = False, executions: int = 1, headless: bool = False):
     while True:
         for e in range(executions):
-            run()
-        plt.show()
-        cv.waitKey()
+            run(headless=headless)
+        if not headless:
+            plt.show()
+            cv.waitKey()
         if not repeat:
             break
 
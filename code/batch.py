@@ -0,0 +1,209 @@
+"""COMP6202 - Evolution of Complexity
+Holds execution class [BatchCoevolution] for running many independent
+replicates of a coevolution run together, as (replicates, n, traits) arrays,
+and its base [ArrayCoevolution] shared with `MultiCoevolution`.
+"""
+
+__authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
+
+import numpy as np
+
+from typing import List, Tuple, Union
+
+from coevolution import HOF, BatchHOF
+from history import HistorySink
+from representation import ArrayPopulation
+from mutation import Mutator
+from scoring import Scorer
+from selection import Selector, FitnessProportionateSelection
+from utils import spawn_rngs, with_rng
+
+
+class ArrayCoevolution:
+    # Order that sub-streams are spawned from the root generator, executors
+    # append their own sub-streams so these are unchanged
+    SUBSTREAMS = ("scorer", "selector", "mutator")
+
+    def __init__(
+        self,
+        scorer: Scorer = Scorer(intransitive=False),
+        selector: Selector = FitnessProportionateSelection(),
+        mutator: Mutator = Mutator(),
+        hof: HOF = None,
+        rng: Union[int, np.random.Generator] = None,
+    ):
+        """Base of executors that hold several populations of the same shape
+        as one array and select and mutate them all in batched operations.
+
+        Args:
+            scorer (Scorer, optional): Scorer for subjective fitness.
+            selector (Selector, optional): Selector for picking parents, see
+                `Selector.select_batch`.
+            mutator (Mutator, optional): Mutator for producing offspring.
+            hof (HOF, optional): Hall of fame, each population gets its own,
+                see `BatchHOF`. Defaults to None.
+            rng (Union[int, np.random.Generator], optional): Root seed or
+                generator, see `Coevolution`. Defaults to None.
+        """
+        self.scorer = scorer
+        self.selector = selector
+        self.mutator = mutator
+        self.hof = hof
+        self.rng = rng
+        self._rngs = {}
+        if rng is not None:
+            rngs = spawn_rngs(rng, len(self.SUBSTREAMS))
+            self._rngs = dict(zip(self.SUBSTREAMS, rngs))
+            self.scorer = with_rng(self.scorer, self._rngs["scorer"])
+            self.selector = with_rng(self.selector, self._rngs["selector"])
+            self.mutator = with_rng(self.mutator, self._rngs["mutator"])
+
+    def next_generation(self, values: np.ndarray, f: np.ndarray) -> np.ndarray:
+        """Select and mutate every population.
+
+        Args:
+            values (np.ndarray): Unitations, (populations, n, traits).
+            f (np.ndarray): Fitness of every individual, (populations, n).
+
+        Returns:
+            np.ndarray: Unitations of the offspring, (populations, n, traits).
+        """
+        idxs = self.selector.select_batch(f)
+        values = np.take_along_axis(values, idxs[..., np.newaxis], axis=1)
+        return self.mutator.mutate_values(values, self.total_bits)
+
+    def _history(
+        self,
+        values_a: np.ndarray,
+        values_b: np.ndarray,
+        subj_a: np.ndarray,
+        subj_b: np.ndarray,
+    ) -> HistorySink:
+        # History of two populations, given as (generations + 1, ...) arrays
+        history = HistorySink()
+        for g in range(len(subj_a)):
+            history.record(
+                g,
+                ArrayPopulation(values_a[g], self.total_bits),
+                ArrayPopulation(values_b[g], self.total_bits),
+                subj_a[g],
+                subj_b[g],
+            )
+        return history
+
+
+class BatchCoevolution(ArrayCoevolution):
+    SUBSTREAMS = ArrayCoevolution.SUBSTREAMS + ("hof_a", "hof_b")
+
+    def __init__(
+        self,
+        scorer: Scorer = Scorer(intransitive=False),
+        selector: Selector = FitnessProportionateSelection(),
+        mutator: Mutator = Mutator(),
+        hof: HOF = None,
+        rng: Union[int, np.random.Generator] = None,
+    ):
+        """Executor that advances R replicates of the same run in lock step.
+        Scoring, selection and mutation of every replicate are each done in
+        one batched operation per generation. Replicates are independent of
+        each other but not bit-identical to runs made with `Coevolution`.
+
+        Args:
+            scorer (Scorer, optional): Scorer for subjective fitness.
+            selector (Selector, optional): Selector for picking parents, see
+                `Selector.select_batch`.
+            mutator (Mutator, optional): Mutator for producing offspring.
+            hof (HOF, optional): Hall of fame, each population of each
+                replicate gets its own, see `BatchHOF`. Defaults to None.
+            rng (Union[int, np.random.Generator], optional): Root seed or
+                generator, see `Coevolution`. Defaults to None.
+        """
+        super().__init__(scorer, selector, mutator, hof, rng)
+
+    def run(
+        self,
+        pop_a: ArrayPopulation,
+        pop_b: ArrayPopulation,
+        generations: int,
+        replicates: int,
+    ):
+        """Run `replicates` independent coevolution runs that all start from
+        the same populations. Histories are stored as arrays:
+
+            values_a, values_b  (generations + 1, replicates, n, traits)
+            subj_a, subj_b      (generations + 1, replicates)
+
+        With a HOF, the halls of fame of every replicate are kept in the
+        `BatchHOF`s `hof_a` and `hof_b`.
+
+        Args:
+            pop_a (ArrayPopulation): Initial population A.
+            pop_b (ArrayPopulation): Initial population B.
+            generations (int): Number of generations to run for.
+            replicates (int): Number of replicates.
+        """
+        self.total_bits = pop_a.total_bits_by_trait
+        shape = (generations + 1, replicates) + pop_a.values.shape
+        self.values_a = np.empty(shape, dtype=ArrayPopulation.DTYPE)
+        self.values_b = np.empty(shape, dtype=ArrayPopulation.DTYPE)
+        self.subj_a = np.empty((generations + 1, replicates))
+        self.subj_b = np.empty((generations + 1, replicates))
+        self.values_a[0] = pop_a.values
+        self.values_b[0] = pop_b.values
+        self.hof_a = BatchHOF.from_hof(self.hof, replicates, self._rngs.get("hof_a"))
+        self.hof_b = BatchHOF.from_hof(self.hof, replicates, self._rngs.get("hof_b"))
+        rows = np.arange(replicates)
+        for g in range(generations + 1):
+            a = self.values_a[g]
+            b = self.values_b[g]
+            f_ab, f_ba = self.assess_fitness(a, b)
+            self.subj_a[g] = f_ab.mean(axis=-1)
+            self.subj_b[g] = f_ba.mean(axis=-1)
+            if self.hof is not None:
+                self.hof_a.add(a[rows, np.argmax(f_ab, axis=-1)])
+                self.hof_b.add(b[rows, np.argmax(f_ba, axis=-1)])
+            if g == generations:
+                break
+            self.values_a[g + 1] = self.next_generation(a, f_ab)
+            self.values_b[g + 1] = self.next_generation(b, f_ba)
+
+    def assess_fitness(
+        self, a: np.ndarray, b: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        f_ab = self._assess_fitness(a, b, self.hof_a)
+        f_ba = self._assess_fitness(b, a, self.hof_b)
+        return (f_ab, f_ba)
+
+    def _assess_fitness(
+        self, values: np.ndarray, opponents: np.ndarray, hof: BatchHOF
+    ) -> np.ndarray:
+        scores = self.scorer.subj_fitness_values(values, opponents)
+        if hof is not None:
+            hof_scores = hof.subj_fitness_values(values)
+            scores = np.concatenate((scores, hof_scores), axis=-1)
+        return scores.mean(axis=-1)
+
+    @property
+    def replicates(self) -> int:
+        return self.subj_a.shape[1]
+
+    def replicate(self, r: int) -> HistorySink:
+        """Get the history of a single replicate as if it had been run
+        alone, which can be plotted directly.
+
+        Args:
+            r (int): The replicate index.
+
+        Returns:
+            HistorySink: History of array populations.
+        """
+        return self._history(
+            self.values_a[:, r],
+            self.values_b[:, r],
+            self.subj_a[:, r],
+            self.subj_b[:, r],
+        )
+
+    def histories(self) -> List[HistorySink]:
+        return [self.replicate(r) for r in range(self.replicates)]
+
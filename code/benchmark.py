@@ -0,0 +1,272 @@
+"""COMP6202 - Evolution of Complexity
+Benchmark suite for scoring, selection, mutation, HOF scoring and full runs
+(array and legacy list populations).
+
+Usage:
+    py benchmark.py [--quick] [--save BASELINE] [--compare BASELINE]
+
+Results can be saved as a baseline and later runs compared against it, any
+benchmark slower than the baseline by more than the tolerance is reported
+as a regression (exit code 1).
+"""
+
+__authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
+
+import argparse
+import json
+import sys
+import timeit
+import numpy as np
+
+from typing import Callable, Dict, List
+
+from batch import BatchCoevolution
+from coevolution import Coevolution, HOF
+from mutation import Mutator
+from representation import Generator
+from scoring import Scorer
+from selection import (
+    FitnessProportionateSelection,
+    StochasticUniversalSampling,
+    TournamentSelection,
+    VirulenceSelector,
+)
+
+# (trait_bits, trait_count) of the report experiments
+SHAPES = [(100, 1), (10, 10), (50, 2)]
+POP_SIZES = [25, 250, 2500]
+HOF_SIZES = [50, 500, 5000]
+DEFAULT_TOLERANCE = 1.25
+# Shortest time of each repeat, shorter repeats are dominated by noise
+MIN_REPEAT_TIME = 0.2
+
+
+def timed(fn: Callable, repeat: int = 9) -> dict:
+    """Time a callable, the number of loops per repeat is picked so that
+    each repeat takes at least `MIN_REPEAT_TIME`.
+
+    Returns:
+        dict: Best time of a loop in seconds ("time"), and the ratio of the
+            slowest repeat to the fastest ("spread").
+    """
+    timer = timeit.Timer(fn)
+    (loops, t) = timer.autorange()
+    loops = max(1, int(np.ceil(loops * MIN_REPEAT_TIME / t)))
+    times = np.array(timer.repeat(repeat=repeat, number=loops)) / loops
+    return {"time": float(times.min()), "spread": float(times.max() / times.min())}
+
+
+def _random_population(generator: Generator, n: int, rng: np.random.Generator):
+    pop = generator.array_population(n, 0)
+    pop.values[:] = rng.integers(generator.trait_bits + 1, size=pop.values.shape)
+    return pop
+
+
+def bench_scoring(shapes, sizes, rng) -> Dict[str, dict]:
+    results = {}
+    for (bits, count) in shapes:
+        generator = Generator(bits, count)
+        for intransitive in (False, True):
+            scorer = Scorer(intransitive=intransitive, rng=rng)
+            exact = Scorer(intransitive=intransitive, exact=True)
+            mode = "intransitive" if intransitive else "transitive"
+            a = _random_population(generator, 2, rng)
+            (ia, ib) = (a[0], a[1])
+            key = "score/{}/{}x{}".format(mode, bits, count)
+            results[key] = timed(lambda: scorer.score(ia, ib))
+            for n in sizes:
+                pop_a = _random_population(generator, n, rng)
+                pop_b = _random_population(generator, n, rng)
+                key = "subj_fitness/{}/{}x{}/n={}".format(mode, bits, count, n)
+                results[key] = timed(lambda: scorer.subj_fitness(ia, pop_b))
+                key = "subj_fitness_population/{}/{}x{}/n={}".format(
+                    mode, bits, count, n
+                )
+                results[key] = timed(
+                    lambda: scorer.subj_fitness_population(pop_a, pop_b)
+                )
+                key = "subj_fitness_population/{}_exact/{}x{}/n={}".format(
+                    mode, bits, count, n
+                )
+                results[key] = timed(
+                    lambda: exact.subj_fitness_population(pop_a, pop_b)
+                )
+    return results
+
+
+def bench_selection(sizes, rng) -> Dict[str, dict]:
+    selectors = {
+        "fps": FitnessProportionateSelection(rng=rng),
+        "sus": StochasticUniversalSampling(rng=rng),
+        "tournament": TournamentSelection(3, rng=rng),
+        "virulence_fps": VirulenceSelector(
+            FitnessProportionateSelection(rng=rng), 0.75
+        ),
+        "virulence_sus": VirulenceSelector(StochasticUniversalSampling(rng=rng), 0.75),
+    }
+    # Sweep of virulence over 50 replicates in one batch
+    lambs = np.linspace(0.5, 1.0, 50)
+    sweep = VirulenceSelector(StochasticUniversalSampling(rng=rng), lambs)
+    results = {}
+    for n in sizes:
+        fs = rng.random(n)
+        for (name, selector) in selectors.items():
+            key = "select/{}/n={}".format(name, n)
+            results[key] = timed(lambda: selector.select(fs, as_array=True))
+        fs_batch = rng.random((len(lambs), n))
+        key = "select_batch/virulence_sweep_sus/n={}/replicates=50".format(n)
+        results[key] = timed(lambda: sweep.select_batch(fs_batch))
+    return results
+
+
+def bench_mutation(shapes, sizes, rng) -> Dict[str, dict]:
+    results = {}
+    for (bits, count) in shapes:
+        generator = Generator(bits, count)
+        ind = generator.individual(bits // 2)
+        for batched in (False, True):
+            mutator = Mutator(batched=batched, rng=rng)
+            mode = "batched" if batched else "per_bit"
+            key = "mutate/{}/{}x{}".format(mode, bits, count)
+            results[key] = timed(lambda: mutator.mutate(ind))
+            for n in sizes:
+                if not batched and n > sizes[0]:
+                    # Per bit mutation of large populations is too slow
+                    continue
+                pop = _random_population(generator, n, rng)
+                key = "mutate_population/{}/{}x{}/n={}".format(mode, bits, count, n)
+                results[key] = timed(lambda: mutator.mutate_population(pop), repeat=7)
+    return results
+
+
+def _full_hof(generator: Generator, size: int, rng: np.random.Generator) -> HOF:
+    hof = HOF(Scorer(sample_size=10), size)
+    members = _random_population(generator, size, rng)
+    for ind in members.values:
+        hof.add(ind, members.total_bits_by_trait)
+    return hof
+
+
+def bench_hof(shapes, sizes, hof_sizes, rng) -> Dict[str, dict]:
+    results = {}
+    for (bits, count) in shapes:
+        generator = Generator(bits, count)
+        for size in hof_sizes:
+            hof = _full_hof(generator, size, rng)
+            for n in sizes:
+                pop = _random_population(generator, n, rng)
+                key = "hof/{}x{}/hof={}/n={}".format(bits, count, size, n)
+                results[key] = timed(lambda: hof.subj_fitness_population(pop))
+    return results
+
+
+def bench_runs(shapes, sizes, hof_sizes, generations: int, rng) -> Dict[str, dict]:
+    results = {}
+
+    def run(generator, n, population, **kwargs):
+        executor = Coevolution(scorer=Scorer(intransitive=True), rng=0, **kwargs)
+        pop_a = population(n, 0)
+        pop_b = population(n, 0)
+        executor.run(pop_a, pop_b, generations)
+
+    for (bits, count) in shapes:
+        generator = Generator(bits, count)
+        for n in sizes:
+            key = "run/{}x{}/n={}".format(bits, count, n)
+            results[key] = timed(
+                lambda: run(generator, n, generator.array_population), repeat=7
+            )
+            key = "run_legacy/{}x{}/n={}".format(bits, count, n)
+            results[key] = timed(
+                lambda: run(generator, n, generator.population), repeat=7
+            )
+        for size in hof_sizes:
+            # Start full so every generation scores against `size` members,
+            # a run is too short to fill the larger ones
+            hof = _full_hof(generator, size, rng)
+            key = "run_hof/{}x{}/hof={}".format(bits, count, size)
+            results[key] = timed(
+                lambda: run(generator, sizes[0], generator.array_population, hof=hof),
+                repeat=7,
+            )
+        key = "run_batch/{}x{}/n={}/replicates=50".format(bits, count, sizes[0])
+        batch = BatchCoevolution(scorer=Scorer(intransitive=True), rng=0)
+        pop = generator.array_population(sizes[0], 0)
+        results[key] = timed(lambda: batch.run(pop, pop, generations, 50), repeat=7)
+    return results
+
+
+def run_benchmarks(quick: bool = False) -> Dict[str, dict]:
+    rng = np.random.default_rng(0)
+    shapes = SHAPES
+    sizes = POP_SIZES[:2] if quick else POP_SIZES
+    hof_sizes = HOF_SIZES[:2] if quick else HOF_SIZES
+    generations = 20 if quick else 100
+    results = {}
+    results.update(bench_scoring(shapes, sizes, rng))
+    results.update(bench_selection(sizes + [100000], rng))
+    results.update(bench_mutation(shapes, sizes, rng))
+    results.update(bench_hof(shapes, sizes, hof_sizes, rng))
+    results.update(bench_runs(shapes, sizes[:2], hof_sizes, generations, rng))
+    return results
+
+
+def compare(
+    results: Dict[str, dict],
+    baseline: Dict[str, dict],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> List[str]:
+    """Compare best times against a baseline. The tolerance of each
+    benchmark is widened by the larger spread of its two measurements, so a
+    slowdown must exceed the noise seen while timing to count as a
+    regression.
+
+    Args:
+        results (Dict[str, dict]): Benchmark results, see `timed`.
+        baseline (Dict[str, dict]): Baseline results.
+        tolerance (float, optional): Slowdown ratio allowed before a
+            benchmark counts as a regression. Defaults to 1.25.
+
+    Returns:
+        List[str]: The benchmarks that regressed.
+    """
+    regressions = []
+    for (key, result) in results.items():
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        ratio = result["time"] / base["time"]
+        allowed = tolerance * max(result["spread"], base["spread"])
+        print("{:<60} {:>12.3e}s {:>7.2f}x".format(key, result["time"], ratio))
+        if ratio > allowed:
+            regressions += [key]
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--quick", action="store_true", help="smaller sweeps")
+    parser.add_argument("--save", help="save results as a baseline")
+    parser.add_argument("--compare", help="baseline to compare results with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(quick=args.quick)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            return 1
+    else:
+        for (key, result) in results.items():
+            print("{:<60} {:>12.3e}s".format(key, result["time"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,24 +7,57 @@ Holds main execution class [Coevolution] for running a GA.
 __authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
 
 import copy
+import json
+import os
 import numpy as np
 
-from typing import List, Tuple
+from typing import List, Tuple, Union
 
-from representation import Population, Individual
+from representation import Population, ArrayPopulation, Individual
 from mutation import Mutator
 from scoring import Scorer
 from selection import Selector, FitnessProportionateSelection
+from history import Sink
+from profiling import Profiler, NullProfiler
+from stopping import StoppingCriterion
+from utils import resolve_rng, spawn_rngs, with_rng
+
+CHECKPOINT_VERSION = 1
 
 
 class Coevolution:
+    # Order that sub-streams are spawned from the root generator
+    SUBSTREAMS = ("scorer", "selector", "mutator", "hof_a", "hof_b")
+
     def __init__(
         self,
         scorer: Scorer = Scorer(intransitive=False),
         selector: Selector = FitnessProportionateSelection(),
         mutator: Mutator = Mutator(),
         hof: HOF = None,
+        rng: Union[int, np.random.Generator] = None,
+        profiler: Profiler = None,
+        stopping: List[StoppingCriterion] = None,
     ):
+        """
+        Args:
+            scorer (Scorer, optional): Scorer for subjective fitness.
+            selector (Selector, optional): Selector for picking parents.
+            mutator (Mutator, optional): Mutator for producing offspring.
+            hof (HOF, optional): Hall of fame to use for both populations, each
+                population gets its own copy. Defaults to None.
+            rng (Union[int, np.random.Generator], optional): Root seed or
+                generator of the run. If provided, every component draws from
+                its own sub-stream spawned from it (see `SUBSTREAMS`) so the
+                run is reproducible regardless of other runs. Defaults to
+                None, where components keep their own generators.
+            profiler (Profiler, optional): Profiler to record phase timings
+                and counts to. Defaults to None, no profiling.
+            stopping (List[StoppingCriterion], optional): Criteria checked
+                every generation, the run ends at the first that fires and
+                it is reported as `stopped_by` and `stopped_at`. Defaults to
+                None, always run every generation.
+        """
         self.scorer = scorer
         self.selector = selector
         self.mutator = mutator
@@ -34,32 +67,263 @@ class Coevolution:
         self.hof = hof is not None
         self.hof_a = copy.deepcopy(hof)
         self.hof_b = copy.deepcopy(hof)
+        self.rng = rng
+        if rng is not None:
+            self._spawn_rngs(rng)
+        self.profiler = profiler if profiler is not None else NullProfiler()
+        if self.profiler.enabled:
+            self.mutator = copy.copy(self.mutator)
+            self.mutator.count_bits = True
+        self.stopping = stopping or []
+        self.stopped_by = None
+        self.stopped_at = None
 
-    def run(self, pop_a: Population, pop_b: Population, generations: int):
+    def _spawn_rngs(self, rng: Union[int, np.random.Generator]):
+        rngs = dict(zip(self.SUBSTREAMS, spawn_rngs(rng, len(self.SUBSTREAMS))))
+        self.scorer = with_rng(self.scorer, rngs["scorer"])
+        self.selector = with_rng(self.selector, rngs["selector"])
+        self.mutator = with_rng(self.mutator, rngs["mutator"])
+        if self.hof:
+            self.hof_a.rng = rngs["hof_a"]
+            self.hof_b.rng = rngs["hof_b"]
+
+    def run(
+        self,
+        pop_a: Population,
+        pop_b: Population,
+        generations: int,
+        sinks: List[Sink] = None,
+        checkpoint: str = None,
+        checkpoint_interval: int = 1000,
+    ):
+        """Run coevolution of two populations.
+
+        Args:
+            pop_a (Population): Initial population A.
+            pop_b (Population): Initial population B.
+            generations (int): Number of generations to run for.
+            sinks (List[Sink], optional): Sinks to stream each generation to.
+                If provided, only the current generation is kept on the
+                executor (`pops_a`, `pops_b`, `subj_a`, `subj_b`), otherwise
+                the full history is kept. Defaults to None.
+            checkpoint (str, optional): File to periodically save the state
+                of the run to, see `resume`. Defaults to None.
+            checkpoint_interval (int, optional): Generations between
+                checkpoints. Defaults to 1000.
+        """
         self.pops_a, self.pops_b = [pop_a], [pop_b]
         self.subj_a, self.subj_b = [], []
-        for g in range(generations + 1):
+        for criterion in self.stopping:
+            criterion.reset()
+        self._run(0, generations, sinks, checkpoint, checkpoint_interval)
+
+    def resume(
+        self,
+        path: str,
+        generations: int = None,
+        sinks: List[Sink] = None,
+        checkpoint: str = None,
+        checkpoint_interval: int = 1000,
+    ):
+        """Resume a run from a checkpoint, continuing exactly as if it had
+        never stopped. The executor must be constructed with the same
+        components as the checkpointed run, the populations, HOFs, score
+        history, stopping criteria and generator states are restored. Only
+        the populations from the checkpoint on are kept in `pops_a` and
+        `pops_b`, use sinks for a complete history e.g. `ArchiveSink.open` or
+        `DiskSink.open`.
+
+        Args:
+            path (str): Checkpoint file to resume from.
+            generations (int, optional): Number of generations to run for in
+                total. Defaults to that of the checkpointed run.
+            sinks (List[Sink], optional): Sinks to stream each generation to,
+                see `run`. Defaults to None.
+            checkpoint (str, optional): File to save further checkpoints to.
+                Defaults to `path`.
+            checkpoint_interval (int, optional): Generations between
+                checkpoints. Defaults to 1000.
+        """
+        (start, checkpoint_generations) = self.load_checkpoint(path)
+        if generations is None:
+            generations = checkpoint_generations
+        if checkpoint is None:
+            checkpoint = path
+        self._run(start, generations, sinks, checkpoint, checkpoint_interval)
+
+    def _run(
+        self,
+        start: int,
+        generations: int,
+        sinks: List[Sink],
+        checkpoint: str,
+        checkpoint_interval: int,
+    ):
+        streaming = sinks is not None
+        prof = self.profiler
+        self.stopped_by, self.stopped_at = None, None
+        for g in range(start, generations + 1):
+            prof.start_generation(g)
             # Use the last populations
             pop_a = self.pops_a[-1]
             pop_b = self.pops_b[-1]
             # Record average subjective score
-            f_ab, f_ba = self.assess_fitness(pop_a, pop_b)
+            with prof.phase("assess"):
+                f_ab, f_ba = self.assess_fitness(pop_a, pop_b)
             self.subj_a += [np.mean(f_ab)]
             self.subj_b += [np.mean(f_ba)]
             if self.hof:
-                self.hof_a.add(pop_a[np.argmax(f_ab)])
-                self.hof_b.add(pop_b[np.argmax(f_ba)])
-            if g == generations:
+                with prof.phase("hof"):
+                    self.hof_a.add(*self._member(pop_a, np.argmax(f_ab)))
+                    self.hof_b.add(*self._member(pop_b, np.argmax(f_ba)))
+            if streaming:
+                subj = (self.subj_a[-1], self.subj_b[-1])
+                with prof.phase("sinks"):
+                    for sink in sinks:
+                        sink.record(g, pop_a, pop_b, *subj)
+            if self.stopping:
+                subj = (self.subj_a[-1], self.subj_b[-1])
+                with prof.phase("stopping"):
+                    for criterion in self.stopping:
+                        if criterion.update(g, pop_a, pop_b, *subj):
+                            self.stopped_by = criterion.name
+                            self.stopped_at = g
+                            break
+            if g == generations or self.stopped_by is not None:
                 break
             # Get next generations
             self.pops_a += [self.next_generation(pop_a, f_ab)]
             self.pops_b += [self.next_generation(pop_b, f_ba)]
+            self.migrate(g + 1)
+            if streaming:
+                # Only keep the current generation
+                del self.pops_a[:-1], self.pops_b[:-1]
+                del self.subj_a[:], self.subj_b[:]
+            if checkpoint and (g + 1) % checkpoint_interval == 0:
+                with prof.phase("checkpoint"):
+                    for sink in sinks or []:
+                        sink.flush()
+                    self.save_checkpoint(checkpoint, g + 1, generations)
+        if streaming:
+            for sink in sinks:
+                if self.stopped_by is not None:
+                    sink.stopped(self.stopped_by, self.stopped_at)
+                sink.close()
+
+    def migrate(self, g: int):
+        """Hook called once the populations of generation `g` have been
+        produced, before they are assessed. Subclasses may modify the last
+        populations in place, e.g. `islands.Island`. Does nothing by default.
+
+        Args:
+            g (int): The generation just produced.
+        """
+        pass
+
+    def _rngs(self) -> List[np.random.Generator]:
+        # Generators drawn from by each component, in `SUBSTREAMS` order
+        rngs = [self.scorer.rng, self.selector.rng, self.mutator.rng]
+        if self.hof:
+            rngs += [self.hof_a.rng, self.hof_b.rng]
+        return [resolve_rng(rng) for rng in rngs]
+
+    def save_checkpoint(self, path: str, g: int, generations: int):
+        """Save the state of the run before generation `g` is assessed to a
+        compressed NumPy archive. The file is replaced atomically so an
+        interrupted save leaves the previous checkpoint intact.
+
+        Args:
+            path (str): File to save to.
+            g (int): The next generation of the run.
+            generations (int): Number of generations the run is for.
+        """
+        (pop_a, pop_b) = (self.pops_a[-1], self.pops_b[-1])
+        is_array = isinstance(pop_a, ArrayPopulation)
+        if not is_array:
+            pop_a = ArrayPopulation.from_population(pop_a)
+            pop_b = ArrayPopulation.from_population(pop_b)
+        meta = {
+            "version": CHECKPOINT_VERSION,
+            "generation": g,
+            "generations": generations,
+            "array": is_array,
+            "rngs": [rng.bit_generator.state for rng in self._rngs()],
+        }
+        arrays = {
+            "values_a": pop_a.values,
+            "values_b": pop_b.values,
+            "total_bits": pop_a.total_bits_by_trait,
+            "subj_a": np.array(self.subj_a, dtype=np.float64),
+            "subj_b": np.array(self.subj_b, dtype=np.float64),
+        }
+        if self.hof:
+            for (name, hof) in (("hof_a", self.hof_a), ("hof_b", self.hof_b)):
+                meta[name] = hof.get_state()
+                arrays[name] = hof.values
+        for (i, criterion) in enumerate(self.stopping):
+            arrays["stopping_{}".format(i)] = np.array(criterion.history)
+        arrays["meta"] = np.array(json.dumps(meta))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+
+    def load_checkpoint(self, path: str) -> Tuple[int, int]:
+        """Restore the state of a run saved by `save_checkpoint`.
+
+        Args:
+            path (str): File to load from.
+
+        Returns:
+            Tuple[int, int]: The next generation of the run and the number of
+                generations the run is for.
+        """
+        with np.load(path) as f:
+            arrays = dict(f)
+        meta = json.loads(str(arrays["meta"]))
+        if meta["version"] != CHECKPOINT_VERSION:
+            raise ValueError("Unsupported checkpoint version")
+        total_bits = arrays["total_bits"]
+        pop_a = ArrayPopulation(arrays["values_a"], total_bits)
+        pop_b = ArrayPopulation(arrays["values_b"], total_bits)
+        if not meta["array"]:
+            pop_a = pop_a.to_population()
+            pop_b = pop_b.to_population()
+        self.pops_a, self.pops_b = [pop_a], [pop_b]
+        self.subj_a = list(arrays["subj_a"])
+        self.subj_b = list(arrays["subj_b"])
+        if self.hof:
+            self.hof_a.set_state(meta["hof_a"], arrays["hof_a"])
+            self.hof_b.set_state(meta["hof_b"], arrays["hof_b"])
+        for (i, criterion) in enumerate(self.stopping):
+            criterion.reset()
+            criterion.history.extend(arrays["stopping_{}".format(i)])
+        for (rng, state) in zip(self._rngs(), meta["rngs"]):
+            rng.bit_generator.state = state
+        return (meta["generation"], meta["generations"])
+
+    @staticmethod
+    def _member(pop: Union[Population, ArrayPopulation], idx: int) -> tuple:
+        # Arguments for adding an individual to a HOF
+        if isinstance(pop, ArrayPopulation):
+            return (pop.values[idx], pop.total_bits_by_trait)
+        return (pop[idx],)
 
     def next_generation(self, pop: Population, f: List[float]) -> Population:
-        idxs = self.selector.select(f)
-        new_pop = Population()
-        for idx in idxs:
-            new_pop += [self.mutator.mutate(pop[idx])]
+        prof = self.profiler
+        is_array = isinstance(pop, ArrayPopulation)
+        with prof.phase("select"):
+            idxs = self.selector.select(f, as_array=is_array)
+        prof.count("selections", len(idxs))
+        bits_mutated = self.mutator.bits_mutated
+        with prof.phase("mutate"):
+            if is_array:
+                new_pop = self.mutator.mutate_population(pop.take(idxs), inplace=True)
+            else:
+                new_pop = Population()
+                for idx in idxs:
+                    new_pop += [self.mutator.mutate(pop[idx])]
+        prof.count("bits_mutated", self.mutator.bits_mutated - bits_mutated)
         return new_pop
 
     def assess_fitness(
@@ -72,22 +336,243 @@ class Coevolution:
     def _assess_fitness(
         self, pop: Population, opponents: Population, hof: HOF = None
     ) -> List[float]:
+        if isinstance(pop, ArrayPopulation):
+            return self._assess_fitness_array(pop, opponents, hof)
         pop_scores = []
-        for i in pop:
+        hof_scores = None
+        if hof:
+            # Members are scored against in one batch rather than sampled
+            # one individual at a time
+            hof_scores = hof.subj_fitness_population(
+                ArrayPopulation.from_population(pop)
+            )
+        for (k, i) in enumerate(pop):
             score = self.scorer.subj_fitness(i, opponents)
             if hof:
-                score += hof.scorer.subj_fitness(i, hof.pop)
+                score += list(hof_scores[k])
             pop_scores += [np.mean(score)]
+        if self.profiler.enabled and pop_scores:
+            # Every individual is scored against the same number of samples
+            self.profiler.count("scores", len(pop) * len(score))
         return pop_scores
 
+    def _assess_fitness_array(
+        self, pop: ArrayPopulation, opponents: ArrayPopulation, hof: HOF = None
+    ) -> np.ndarray:
+        scores = self.scorer.subj_fitness_population(pop, opponents)
+        if hof:
+            hof_scores = hof.subj_fitness_population(pop)
+            scores = np.concatenate((scores, hof_scores), axis=1)
+        self.profiler.count("scores", scores.size)
+        return scores.mean(axis=1)
+
 
 class HOF:
-    def __init__(self, scorer: Scorer, size: int):
+    def __init__(self, scorer: Scorer, size: int, rng: np.random.Generator = None):
+        """Hall of fame of the last `size` elites. Members are held in a
+        fixed capacity circular array of unitations so that adding is O(1)
+        and scoring against the members is a single batched operation.
+
+        Args:
+            scorer (Scorer): Scorer for subjective fitness against members.
+            size (int): Maximum number of members.
+            rng (np.random.Generator, optional): Generator for the scorer to
+                draw from. Defaults to the scorer's generator.
+        """
         self.scorer = scorer
         self.size = size
-        self.pop = Population()
+        self._values = None
+        self._total_bits = None
+        self._next = 0
+        self._count = 0
+        if rng is not None:
+            self.rng = rng
+
+    @property
+    def rng(self) -> np.random.Generator:
+        return self.scorer.rng
+
+    @rng.setter
+    def rng(self, rng: np.random.Generator):
+        # Scorers may be shared so draw using a copy
+        self.scorer = with_rng(self.scorer, rng)
+
+    def add(self, ind: Union[Individual, np.ndarray], total_bits: np.ndarray = None):
+        """Add a member, replacing the oldest member if full.
+
+        Args:
+            ind (Union[Individual, np.ndarray]): The individual, or the
+                unitations of its traits.
+            total_bits (np.ndarray, optional): Total bits of each trait, only
+                used if adding unitations and required for the first member.
+                Defaults to None.
+        """
+        if isinstance(ind, Individual):
+            total_bits = ind.total_bits_by_trait
+            ind = ind.values
+        if self._total_bits is None:
+            if total_bits is None:
+                raise ValueError("Total bits required to add unitations")
+            self._total_bits = np.array(total_bits)
+        if self._values is None:
+            self._values = np.empty((self.size, len(ind)), dtype=ArrayPopulation.DTYPE)
+        self._values[self._next] = ind
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    @property
+    def values(self) -> np.ndarray:
+        """Unitations of the members in storage order, (count, traits)."""
+        if self._values is None:
+            return np.empty((0, 0), dtype=ArrayPopulation.DTYPE)
+        return self._values[: self._count]
+
+    @property
+    def pop(self) -> ArrayPopulation:
+        """The members from oldest to newest."""
+        if self._count < self.size:
+            values = self.values
+        else:
+            values = np.roll(self._values, -self._next, axis=0)
+        total_bits = self._total_bits
+        if total_bits is None:
+            # Only an empty HOF has no total bits
+            total_bits = np.zeros(values.shape[1])
+        return ArrayPopulation(values, total_bits)
+
+    def subj_fitness_population(self, pop: ArrayPopulation) -> np.ndarray:
+        """Score every individual of a population against sampled members.
+
+        Args:
+            pop (ArrayPopulation): The individuals to score.
+
+        Returns:
+            np.ndarray: Scores with shape (n, sample size), or (n, 0) if there
+                are no members.
+        """
+        if self._count == 0:
+            return np.zeros((len(pop), 0))
+        return self.scorer.subj_fitness_values(pop.values, self.values)
+
+    def get_state(self) -> dict:
+        """JSON serialisable state besides the member unitations, which are
+        given by `values`.
+        """
+        total_bits = self._total_bits
+        return {
+            "next": self._next,
+            "total_bits": None if total_bits is None else total_bits.tolist(),
+        }
+
+    def set_state(self, state: dict, values: np.ndarray):
+        """Restore the state of a HOF, see `get_state`.
+
+        Args:
+            state (dict): The state.
+            values (np.ndarray): Unitations of the members in storage order.
+        """
+        self._count = len(values)
+        self._next = state["next"]
+        self._total_bits = state["total_bits"]
+        if self._total_bits is not None:
+            self._total_bits = np.array(self._total_bits)
+        self._values = None
+        if self._count:
+            self._values = np.empty((self.size, values.shape[1]), dtype=values.dtype)
+            self._values[: self._count] = values
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class BatchHOF:
+    def __init__(
+        self,
+        scorer: Scorer,
+        size: int,
+        populations: int,
+        rng: np.random.Generator = None,
+    ):
+        """Halls of fame of several populations evolved in lock step, held
+        as one (populations, size, traits) circular array. Every population
+        gains a member at once so all hold the same number, and every
+        population is scored against its own members in one batched
+        operation.
+
+        Args:
+            scorer (Scorer): Scorer for subjective fitness against members.
+            size (int): Maximum number of members of each population.
+            populations (int): Number of populations.
+            rng (np.random.Generator, optional): Generator for the scorer to
+                draw from. Defaults to the scorer's generator.
+        """
+        self.scorer = scorer
+        self.size = size
+        self.populations = populations
+        self._values = None
+        self._next = 0
+        self._count = 0
+        if rng is not None:
+            self.rng = rng
+
+    @classmethod
+    def from_hof(
+        cls, hof: HOF, populations: int, rng: np.random.Generator = None
+    ) -> BatchHOF:
+        """Halls of fame with the scorer and size of a `HOF`, or None if
+        there is no HOF.
+        """
+        if hof is None:
+            return None
+        return cls(hof.scorer, hof.size, populations, rng)
+
+    @property
+    def rng(self) -> np.random.Generator:
+        return self.scorer.rng
+
+    @rng.setter
+    def rng(self, rng: np.random.Generator):
+        # Scorers may be shared so draw using a copy
+        self.scorer = with_rng(self.scorer, rng)
+
+    def add(self, values: np.ndarray):
+        """Add a member to every population, replacing the oldest members if
+        full.
+
+        Args:
+            values (np.ndarray): Unitations of each new member,
+                (populations, traits).
+        """
+        if self._values is None:
+            shape = (self.populations, self.size, values.shape[-1])
+            self._values = np.empty(shape, dtype=ArrayPopulation.DTYPE)
+        self._values[:, self._next] = values
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    @property
+    def values(self) -> np.ndarray:
+        """Unitations of the members in storage order,
+        (populations, count, traits).
+        """
+        if self._values is None:
+            return np.empty((self.populations, 0, 0), dtype=ArrayPopulation.DTYPE)
+        return self._values[:, : self._count]
+
+    def subj_fitness_values(self, values: np.ndarray) -> np.ndarray:
+        """Score every individual of every population against sampled
+        members of its population's hall of fame.
+
+        Args:
+            values (np.ndarray): Unitations, (populations, n, traits).
+
+        Returns:
+            np.ndarray: Scores with shape (populations, n, sample size), or
+                (populations, n, 0) if there are no members.
+        """
+        if self._count == 0:
+            return np.zeros(values.shape[:-1] + (0,))
+        return self.scorer.subj_fitness_values(values, self.values)
 
-    def add(self, ind: Individual):
-        self.pop += [ind]
-        if len(self.pop) > self.size:
-            self.pop.pop(0)
+    def __len__(self) -> int:
+        return self._count
@@ -0,0 +1,278 @@
+"""COMP6202 - Evolution of Complexity
+Holds declarative experiment configuration [ExperimentConfig] and a content
+addressed result cache [ResultCache] of run archives.
+
+Components are described by specs, a dict with a "type" naming the
+component and its constructor arguments, where arguments may be specs
+themselves, e.g. a virulence selector wrapping SUS:
+
+    {"type": "virulence", "lamb": 0.75, "selector": {"type": "sus"}}
+"""
+
+__authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
+
+import hashlib
+import json
+import os
+import shutil
+
+from typing import Any, List, Tuple
+
+from archive import RunArchive
+from coevolution import HOF
+from mutation import Mutator
+from parallel import ParallelScorer
+from representation import Generator
+from runner import Experiment, map_jobs
+from scoring import Scorer, F0Scorer
+from selection import (
+    Bias,
+    FitnessProportionateSelection,
+    Normalise,
+    RankScaling,
+    SelectionPipeline,
+    StochasticUniversalSampling,
+    TournamentSelection,
+    Virulence,
+    VirulenceSelector,
+)
+from stopping import Convergence, Cycling, Disengagement
+
+# Bump to invalidate cached results when simulation behaviour changes
+CACHE_VERSION = 1
+
+COMPONENTS = {
+    "scorer": Scorer,
+    "f0_scorer": F0Scorer,
+    "parallel": ParallelScorer,
+    "fps": FitnessProportionateSelection,
+    "sus": StochasticUniversalSampling,
+    "tournament": TournamentSelection,
+    "virulence": VirulenceSelector,
+    "pipeline": SelectionPipeline,
+    "normalise": Normalise,
+    "virulence_scaling": Virulence,
+    "rank_scaling": RankScaling,
+    "bias": Bias,
+    "mutator": Mutator,
+    "hof": HOF,
+    "disengagement": Disengagement,
+    "convergence": Convergence,
+    "cycling": Cycling,
+}
+
+
+def build(spec: Any) -> Any:
+    """Build a component from its spec, nested specs (and lists of specs)
+    are built first and anything that is not a spec is returned as is.
+    """
+    if isinstance(spec, list):
+        return [build(s) for s in spec]
+    if isinstance(spec, dict) and "type" in spec:
+        kwargs = {k: build(v) for (k, v) in spec.items() if k != "type"}
+        return COMPONENTS[spec["type"]](**kwargs)
+    return spec
+
+
+class ExperimentConfig:
+    # Fields that describe how a run is simulated, used for the cache key
+    RUN_FIELDS = (
+        "trait_bits",
+        "trait_count",
+        "generations",
+        "n",
+        "init_a",
+        "init_b",
+        "seed",
+        "scorer",
+        "selector",
+        "mutator",
+        "hof",
+        "stopping",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trait_bits: int,
+        trait_count: int,
+        generations: int,
+        n: int = 25,
+        init_a: int = 0,
+        init_b: int = 0,
+        seed: int = None,
+        scorer: dict = None,
+        selector: dict = None,
+        mutator: dict = None,
+        hof: dict = None,
+        stopping: List[dict] = None,
+        export_name: str = None,
+    ):
+        """Declarative description of an experiment, component arguments are
+        specs (see `build`) and default to the `Coevolution` defaults.
+
+        Args:
+            name (str): Name used to describe the experiment.
+            trait_bits (int): Bits of each trait.
+            trait_count (int): Number of traits.
+            generations (int): Number of generations to run for.
+            n (int, optional): Population size. Defaults to 25.
+            init_a (int, optional): Initial trait value of population A.
+                Defaults to 0.
+            init_b (int, optional): Initial trait value of population B.
+                Defaults to 0.
+            seed (int, optional): Seed of the run, runs without a seed are
+                never cached. Defaults to None.
+            scorer (dict, optional): Scorer spec. Defaults to None.
+            selector (dict, optional): Selector spec. Defaults to None.
+            mutator (dict, optional): Mutator spec. Defaults to None.
+            hof (dict, optional): HOF spec. Defaults to None.
+            stopping (List[dict], optional): Stopping criterion specs.
+                Defaults to None.
+            export_name (str, optional): File name to export the plot as.
+                Defaults to None.
+        """
+        self.name = name
+        self.trait_bits = trait_bits
+        self.trait_count = trait_count
+        self.generations = generations
+        self.n = n
+        self.init_a = init_a
+        self.init_b = init_b
+        self.seed = seed
+        self.scorer = scorer
+        self.selector = selector
+        self.mutator = mutator
+        self.hof = hof
+        self.stopping = stopping
+        self.export_name = export_name
+
+    @classmethod
+    def from_dict(cls, cfg: dict) -> "ExperimentConfig":
+        return cls(**cfg)
+
+    def to_dict(self) -> dict:
+        cfg = {k: getattr(self, k) for k in self.RUN_FIELDS}
+        cfg.update(name=self.name, export_name=self.export_name)
+        return cfg
+
+    def sweep(self, runs: int) -> List["ExperimentConfig"]:
+        """Configs for running the experiment with `runs` seeds spawned from
+        its seed (see `Experiment.seeds`), plots are exported per seed.
+        """
+        if runs == 1:
+            return [self]
+        cfgs = []
+        for seed in self.experiment().seeds(runs):
+            cfg = ExperimentConfig.from_dict(self.to_dict())
+            cfg.seed = seed
+            if self.export_name:
+                (name, ext) = os.path.splitext(self.export_name)
+                cfg.export_name = "{}_{}{}".format(name, seed, ext)
+            cfgs += [cfg]
+        return cfgs
+
+    def describe(self, seed: int) -> str:
+        return "{} : [Seed {}]".format(self.name, seed)
+
+    def key(self) -> str:
+        """Content hash of everything that affects the result of the run."""
+        cfg = {k: getattr(self, k) for k in self.RUN_FIELDS}
+        cfg["version"] = CACHE_VERSION
+        encoded = json.dumps(cfg, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def experiment(self) -> Experiment:
+        kwargs = {}
+        for k in ("scorer", "selector", "mutator", "hof", "stopping"):
+            if getattr(self, k) is not None:
+                kwargs[k] = build(getattr(self, k))
+        return Experiment(
+            self.name,
+            Generator(self.trait_bits, self.trait_count),
+            self.generations,
+            n=self.n,
+            init_a=self.init_a,
+            init_b=self.init_b,
+            seed=self.seed,
+            export_name=self.export_name,
+            **kwargs
+        )
+
+
+class ResultCache:
+    def __init__(self, folder: str):
+        """Cache of run archives keyed by the content hash of their config.
+
+        Args:
+            folder (str): Folder holding an archive per cached run.
+        """
+        self.folder = folder
+
+    def path(self, cfg: ExperimentConfig) -> str:
+        return os.path.join(self.folder, cfg.key())
+
+    def load(self, cfg: ExperimentConfig) -> RunArchive:
+        """Load the cached result of a config, None if not cached."""
+        if cfg.seed is None or not os.path.exists(self.path(cfg)):
+            return None
+        return RunArchive(self.path(cfg))
+
+    def run(
+        self, cfgs: List[ExperimentConfig], processes: int = None
+    ) -> List[Tuple[ExperimentConfig, int, RunArchive]]:
+        """Get the result of every config, simulating (in parallel) and
+        caching only those that are not already cached.
+
+        Args:
+            cfgs (List[ExperimentConfig]): The experiments to run.
+            processes (int, optional): Number of worker processes, 1 runs
+                in this process. Defaults to the number of CPUs.
+
+        Returns:
+            List[Tuple[ExperimentConfig, int, RunArchive]]: The config, seed
+                and archived result of each experiment, in order.
+        """
+        results = [self.load(cfg) for cfg in cfgs]
+        jobs = []
+        scheduled = {}
+        for (i, (cfg, result)) in enumerate(zip(cfgs, results)):
+            if result is None:
+                if cfg.seed is not None and cfg.key() in scheduled:
+                    # Same run as an earlier config
+                    continue
+                seed = cfg.experiment().seeds()[0]
+                jobs += [(i, cfg, seed, self._staging_path(cfg, seed))]
+                scheduled[cfg.key()] = i
+        map_jobs(_run_job, jobs, processes)
+        # Move finished seeded runs into the cache
+        for (i, cfg, seed, path) in jobs:
+            if cfg.seed is not None:
+                if os.path.exists(self.path(cfg)):
+                    shutil.rmtree(self.path(cfg))
+                os.replace(path, self.path(cfg))
+                path = self.path(cfg)
+            results[i] = RunArchive(path)
+        for (i, cfg) in enumerate(cfgs):
+            if results[i] is None:
+                results[i] = results[scheduled[cfg.key()]]
+        return [(cfg, r.meta["seed"], r) for (cfg, r) in zip(cfgs, results)]
+
+    def _staging_path(self, cfg: ExperimentConfig, seed: int) -> str:
+        if cfg.seed is None:
+            # Unseeded runs are kept but never loaded as cached results
+            name = "{}_{}".format(cfg.key(), seed)
+            return os.path.join(self.folder, "unseeded", name)
+        return os.path.join(self.folder, "tmp", cfg.key())
+
+    def clear(self):
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder)
+
+
+def _run_job(job: Tuple[int, ExperimentConfig, int, str]):
+    (_, cfg, seed, path) = job
+    experiment = cfg.experiment()
+    sink = experiment.archive_sink(path, seed)
+    sink.meta["config"] = cfg.to_dict()
+    experiment.run(seed, sinks=[sink])
@@ -0,0 +1,224 @@
+"""COMP6202 - Evolution of Complexity
+Holds sinks that generations of a coevolution run are streamed to. Only
+sinks keep data so the memory used by a run is bounded by the sinks used.
+"""
+
+__authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
+
+import numpy as np
+
+from collections import deque
+from typing import BinaryIO, Union
+
+from representation import Population, ArrayPopulation
+
+
+def _total_bits_by_trait(pop: Union[Population, ArrayPopulation]) -> np.ndarray:
+    # Array populations hold it without making an individual
+    if isinstance(pop, ArrayPopulation):
+        return pop.total_bits_by_trait
+    return np.asarray(pop[0].total_bits_by_trait)
+
+
+class Sink:
+    def record(
+        self,
+        g: int,
+        pop_a: Union[Population, ArrayPopulation],
+        pop_b: Union[Population, ArrayPopulation],
+        subj_a: float,
+        subj_b: float,
+    ):
+        """Record a generation of a run.
+
+        Args:
+            g (int): The generation number.
+            pop_a (Union[Population, ArrayPopulation]): Population A.
+            pop_b (Union[Population, ArrayPopulation]): Population B.
+            subj_a (float): Average subjective score of population A.
+            subj_b (float): Average subjective score of population B.
+        """
+        pass
+
+    def stopped(self, criterion: str, g: int):
+        """Called before `close` if the run was ended by a stopping
+        criterion.
+
+        Args:
+            criterion (str): Name of the criterion that fired.
+            g (int): The generation it fired at, the last recorded.
+        """
+        pass
+
+    def flush(self):
+        """Write out anything buffered, called before a checkpoint is saved
+        so the sink is consistent with it.
+        """
+        pass
+
+    def close(self):
+        """Called once the run has finished."""
+        pass
+
+
+class HistorySink(Sink):
+    """Keeps every recorded generation, can be plotted directly.
+    """
+
+    def __init__(self):
+        self.gens, self.pops_a, self.pops_b = [], [], []
+        self.subj_a, self.subj_b = [], []
+
+    def record(self, g, pop_a, pop_b, subj_a, subj_b):
+        self.gens += [g]
+        self.pops_a += [pop_a]
+        self.pops_b += [pop_b]
+        self.subj_a += [subj_a]
+        self.subj_b += [subj_b]
+
+
+class RingBufferSink(HistorySink):
+    """Keeps only the last `size` generations.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.gens, self.pops_a, self.pops_b = (deque(maxlen=size) for i in range(3))
+        self.subj_a, self.subj_b = deque(maxlen=size), deque(maxlen=size)
+
+    def record(self, g, pop_a, pop_b, subj_a, subj_b):
+        self.gens.append(g)
+        self.pops_a.append(pop_a)
+        self.pops_b.append(pop_b)
+        self.subj_a.append(subj_a)
+        self.subj_b.append(subj_b)
+
+
+class SnapshotSink(HistorySink):
+    """Keeps every `interval`-th generation.
+    """
+
+    def __init__(self, interval: int):
+        super().__init__()
+        self.interval = interval
+
+    def record(self, g, pop_a, pop_b, subj_a, subj_b):
+        if g % self.interval == 0:
+            super().record(g, pop_a, pop_b, subj_a, subj_b)
+
+
+class StatsSink(Sink):
+    """Keeps per generation statistics of the objective values instead of
+    the populations themselves.
+    """
+
+    def __init__(self):
+        self.gens, self.total_bits = [], None
+        self.mean_a, self.min_a, self.max_a = [], [], []
+        self.mean_b, self.min_b, self.max_b = [], [], []
+        self.subj_a, self.subj_b = [], []
+
+    def record(self, g, pop_a, pop_b, subj_a, subj_b):
+        value_a = pop_a.value
+        value_b = pop_b.value
+        if self.total_bits is None:
+            # Same every generation, so only read it once
+            self.total_bits = int(np.sum(_total_bits_by_trait(pop_a)))
+        self.gens += [g]
+        self.mean_a += [np.mean(value_a)]
+        self.min_a += [np.min(value_a)]
+        self.max_a += [np.max(value_a)]
+        self.mean_b += [np.mean(value_b)]
+        self.min_b += [np.min(value_b)]
+        self.max_b += [np.max(value_b)]
+        self.subj_a += [subj_a]
+        self.subj_b += [subj_b]
+
+
+class DiskSink(Sink):
+    """Streams every generation to a file as a sequence of NumPy arrays,
+    use `DiskSink.load` to read it back.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.resume = False
+
+    @classmethod
+    def open(cls, path: str) -> "DiskSink":
+        """Reopen a file to continue writing to it, e.g. when resuming a run
+        from a checkpoint. Generations recorded from the first generation
+        recorded after reopening on are overwritten as the run is repeated
+        from there.
+
+        Args:
+            path (str): File written by a `DiskSink`.
+
+        Returns:
+            DiskSink: Sink appending to the existing file.
+        """
+        sink = cls(path)
+        sink.resume = True
+        return sink
+
+    def record(self, g, pop_a, pop_b, subj_a, subj_b):
+        if self.file is None:
+            if self.resume:
+                end = DiskSink._find(self.path, g)
+                self.file = open(self.path, "ab")
+                self.file.truncate(end)
+            else:
+                self.file = open(self.path, "wb")
+                np.save(self.file, _total_bits_by_trait(pop_a))
+        np.save(self.file, np.array([g, subj_a, subj_b]))
+        np.save(self.file, pop_a.values)
+        np.save(self.file, pop_b.values)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    @staticmethod
+    def _find(path: str, g: int) -> int:
+        # Offset of the first record of generation `g` or later, or of an
+        # incomplete record left by an interrupted run
+        with open(path, "rb") as f:
+            np.load(f)
+            while not DiskSink._at_end(f):
+                pos = f.tell()
+                try:
+                    if np.load(f)[0] >= g:
+                        return pos
+                    np.load(f)
+                    np.load(f)
+                except (ValueError, EOFError):
+                    return pos
+            return f.tell()
+
+    @staticmethod
+    def load(path: str) -> HistorySink:
+        """Read a file written by a `DiskSink` into a `HistorySink` of array
+        populations.
+        """
+        history = HistorySink()
+        with open(path, "rb") as f:
+            total_bits = np.load(f)
+            while not DiskSink._at_end(f):
+                (g, subj_a, subj_b) = np.load(f)
+                pop_a = ArrayPopulation(np.load(f), total_bits)
+                pop_b = ArrayPopulation(np.load(f), total_bits)
+                history.record(int(g), pop_a, pop_b, subj_a, subj_b)
+        return history
+
+    @staticmethod
+    def _at_end(f: BinaryIO) -> bool:
+        pos = f.tell()
+        at_end = not f.read(1)
+        f.seek(pos)
+        return at_end
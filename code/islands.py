@@ -0,0 +1,272 @@
+"""COMP6202 - Evolution of Complexity
+Holds island-model execution class [IslandCoevolution]. Each island is an
+A/B population pair evolved by its own `Coevolution` in a worker process,
+every `interval` generations islands exchange migrants through a shared
+memory array of unitations.
+
+Topologies give the islands each island receives migrants from:
+
+    ring    The previous island.
+    full    Every other island.
+    random  A random other island, drawn at each migration.
+"""
+
+__authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
+
+import multiprocessing
+import traceback
+import numpy as np
+
+from multiprocessing import shared_memory
+from typing import Callable, List, Union
+
+from coevolution import Coevolution
+from history import StatsSink
+from representation import Population, ArrayPopulation
+from utils import make_rng, spawn_rngs
+
+
+def ring(i: int, islands: int, rng: np.random.Generator) -> List[int]:
+    return [(i - 1) % islands]
+
+
+def full(i: int, islands: int, rng: np.random.Generator) -> List[int]:
+    return [j for j in range(islands) if j != i]
+
+
+def random_neighbour(i: int, islands: int, rng: np.random.Generator) -> List[int]:
+    j = int(rng.integers(islands - 1))
+    return [j + (j >= i)]
+
+
+TOPOLOGIES = {"ring": ring, "full": full, "random": random_neighbour}
+
+
+class Island(Coevolution):
+    def __init__(
+        self,
+        index: int,
+        buffer: np.ndarray,
+        barrier: multiprocessing.Barrier,
+        interval: int,
+        migrants: int,
+        topology: Callable,
+        **kwargs
+    ):
+        """Coevolution of one island, exchanging migrants with the other
+        islands after every `interval` generations. Emigrants are random
+        offspring, so already biased by selection, and immigrants replace
+        random offspring before they are assessed.
+
+        Args:
+            index (int): Index of the island.
+            buffer (np.ndarray): Shared (2, islands, migrants, traits)
+                unitations of the emigrants of each population and island.
+            barrier (multiprocessing.Barrier): Barrier of all islands.
+            interval (int): Generations between migrations.
+            migrants (int): Emigrants per population per migration.
+            topology (Callable): Gives the islands to receive from.
+            **kwargs: Arguments used to construct the `Coevolution`, the
+                root generator `rng` is required.
+        """
+        super().__init__(**kwargs)
+        self.index = index
+        self.buffer = buffer
+        self.barrier = barrier
+        self.interval = interval
+        self.migrants = migrants
+        self.topology = topology
+        # Drawn after the component sub-streams so those are unchanged
+        self.migration_rng = make_rng(kwargs["rng"]).spawn(1)[0]
+
+    def migrate(self, g: int):
+        islands = self.buffer.shape[1]
+        if g % self.interval or islands == 1:
+            return
+        rng = self.migration_rng
+        pops = (self.pops_a[-1], self.pops_b[-1])
+        for (k, pop) in enumerate(pops):
+            idxs = rng.choice(len(pop), self.migrants, replace=False)
+            self.buffer[k, self.index] = pop.values[idxs]
+        self.barrier.wait()
+        sources = self.topology(self.index, islands, rng)
+        for (k, pop) in enumerate(pops):
+            immigrants = self.buffer[k, sources].reshape(-1, pop.trait_count)
+            count = min(len(immigrants), len(pop))
+            slots = rng.choice(len(pop), count, replace=False)
+            pop.values[slots] = immigrants[:count]
+        # Wait for every island to read before emigrants are overwritten
+        self.barrier.wait()
+
+
+class IslandCoevolution:
+    def __init__(
+        self,
+        islands: int = 4,
+        interval: int = 50,
+        migrants: int = 2,
+        topology: Union[str, Callable] = "ring",
+        rng: Union[int, np.random.Generator] = None,
+        **kwargs
+    ):
+        """Executor that evolves several A/B population pairs (islands) at
+        once, one worker process per island. Selection and scoring within
+        an island are exactly those of `Coevolution`, islands only interact
+        through migration.
+
+        Args:
+            islands (int, optional): Number of islands. Defaults to 4.
+            interval (int, optional): Generations between migrations.
+                Defaults to 50.
+            migrants (int, optional): Emigrants per population per island
+                per migration. Defaults to 2.
+            topology (Union[str, Callable], optional): Name of a topology in
+                `TOPOLOGIES`, or a function of (island, islands, rng) giving
+                the islands to receive from. Defaults to "ring".
+            rng (Union[int, np.random.Generator], optional): Root seed or
+                generator, each island's `Coevolution` gets its own spawned
+                generator. Defaults to None.
+            **kwargs: Arguments used to construct each island's
+                `Coevolution`. Stopping criteria are not supported, since
+                islands migrate in lock step.
+        """
+        if kwargs.get("stopping"):
+            raise ValueError("Stopping criteria are not supported by islands")
+        if isinstance(topology, str):
+            topology = TOPOLOGIES[topology]
+        self.islands = islands
+        self.interval = interval
+        self.migrants = migrants
+        self.topology = topology
+        self.rng = rng
+        self.coevolution_kwargs = kwargs
+
+    def run(
+        self,
+        pop_a: Union[Population, ArrayPopulation],
+        pop_b: Union[Population, ArrayPopulation],
+        generations: int,
+    ):
+        """Run every island from the same initial populations. Per island
+        statistics are kept in `island_stats`, their aggregate in `stats`
+        and the final populations in `island_pops_a` and `island_pops_b`.
+
+        Args:
+            pop_a (Union[Population, ArrayPopulation]): Initial population A.
+            pop_b (Union[Population, ArrayPopulation]): Initial population B.
+            generations (int): Number of generations to run for.
+        """
+        if not isinstance(pop_a, ArrayPopulation):
+            pop_a = ArrayPopulation.from_population(pop_a)
+            pop_b = ArrayPopulation.from_population(pop_b)
+        if self.migrants > len(pop_a):
+            raise ValueError("More migrants than individuals in a population")
+        shape = (2, self.islands, self.migrants, pop_a.trait_count)
+        dtype = np.dtype(ArrayPopulation.DTYPE)
+        shm = shared_memory.SharedMemory(
+            create=True, size=int(np.prod(shape)) * dtype.itemsize
+        )
+        ctx = multiprocessing.get_context()
+        barrier = ctx.Barrier(self.islands)
+        queue = ctx.Queue()
+        rngs = spawn_rngs(self.rng, self.islands)
+        workers = []
+        try:
+            for (i, rng) in enumerate(rngs):
+                args = (
+                    i,
+                    shm.name,
+                    shape,
+                    barrier,
+                    queue,
+                    self.interval,
+                    self.migrants,
+                    self.topology,
+                    pop_a,
+                    pop_b,
+                    generations,
+                    dict(self.coevolution_kwargs, rng=rng),
+                )
+                workers += [ctx.Process(target=_run_island, args=args)]
+            for worker in workers:
+                worker.start()
+            # Drain every result before joining the workers
+            results = [None] * self.islands
+            for _ in range(self.islands):
+                (i, result) = queue.get()
+                results[i] = result
+        finally:
+            for worker in workers:
+                worker.join()
+            shm.close()
+            shm.unlink()
+        for (i, result) in enumerate(results):
+            if isinstance(result, str):
+                raise RuntimeError("Island {} failed:\n{}".format(i, result))
+        total_bits = pop_a.total_bits_by_trait
+        self.island_stats = [stats for (stats, _, _) in results]
+        self.island_pops_a = [ArrayPopulation(a, total_bits) for (_, a, _) in results]
+        self.island_pops_b = [ArrayPopulation(b, total_bits) for (_, _, b) in results]
+        self.stats = IslandCoevolution.aggregate(self.island_stats)
+
+    @staticmethod
+    def aggregate(island_stats: List[StatsSink]) -> StatsSink:
+        """Combine the statistics of every island as if they were one large
+        population, which can be plotted directly.
+
+        Args:
+            island_stats (List[StatsSink]): Statistics of each island.
+
+        Returns:
+            StatsSink: Mean of the means and subjective scores and the
+                extremes of the minimums and maximums.
+        """
+        stats = StatsSink()
+        stats.gens = list(island_stats[0].gens)
+        stats.total_bits = island_stats[0].total_bits
+        for (name, reduce) in (
+            ("mean_a", np.mean),
+            ("mean_b", np.mean),
+            ("min_a", np.min),
+            ("min_b", np.min),
+            ("max_a", np.max),
+            ("max_b", np.max),
+            ("subj_a", np.mean),
+            ("subj_b", np.mean),
+        ):
+            values = np.array([getattr(s, name) for s in island_stats])
+            setattr(stats, name, list(reduce(values, axis=0)))
+        return stats
+
+
+def _run_island(
+    i: int,
+    shm_name: str,
+    shape: tuple,
+    barrier: multiprocessing.Barrier,
+    queue: multiprocessing.Queue,
+    interval: int,
+    migrants: int,
+    topology: Callable,
+    pop_a: ArrayPopulation,
+    pop_b: ArrayPopulation,
+    generations: int,
+    kwargs: dict,
+):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    (buffer, island) = (None, None)
+    try:
+        buffer = np.ndarray(shape, dtype=ArrayPopulation.DTYPE, buffer=shm.buf)
+        island = Island(i, buffer, barrier, interval, migrants, topology, **kwargs)
+        stats = StatsSink()
+        island.run(pop_a.copy(), pop_b.copy(), generations, sinks=[stats])
+        result = (stats, island.pops_a[-1].values, island.pops_b[-1].values)
+    except Exception:
+        # Release the other islands rather than leave them waiting
+        barrier.abort()
+        result = traceback.format_exc()
+    finally:
+        # Views of the shared memory must be released before closing it
+        (buffer, island) = (None, None)
+        shm.close()
+    queue.put((i, result))
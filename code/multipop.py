@@ -0,0 +1,231 @@
+"""COMP6202 - Evolution of Complexity
+Holds execution class [MultiCoevolution] for coevolving N populations, each
+scored against the opponents given by an interaction schedule:
+
+    full          Every other population, every generation.
+    round_robin   `k` other populations per generation, cycling through all
+                  of them in turn.
+    random        `k` random other populations (neighbours), fixed for the
+                  run or redrawn every generation.
+"""
+
+__authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
+
+import numpy as np
+
+from typing import List, Union
+
+from batch import ArrayCoevolution
+from coevolution import HOF, BatchHOF
+from history import HistorySink
+from mutation import Mutator
+from representation import Population, ArrayPopulation
+from scoring import Scorer
+from selection import Selector, FitnessProportionateSelection
+from utils import resolve_rng
+
+
+class Schedule:
+    def reset(self, populations: int, rng: np.random.Generator = None):
+        """Called at the start of every run.
+
+        Args:
+            populations (int): Number of populations.
+            rng (np.random.Generator, optional): Generator for random
+                schedules. Defaults to the module-level generator.
+        """
+        self.populations = populations
+        self.rng = rng
+
+    def opponents(self, g: int) -> List[List[int]]:
+        """Get the populations each population is scored against.
+
+        Args:
+            g (int): The generation number.
+
+        Returns:
+            List[List[int]]: Opponent populations of each population.
+        """
+        pass
+
+
+class FullSchedule(Schedule):
+    def opponents(self, g):
+        p = self.populations
+        return [[j for j in range(p) if j != i] for i in range(p)]
+
+
+class RoundRobinSchedule(Schedule):
+    def __init__(self, k: int = 1):
+        """
+        Args:
+            k (int, optional): Opponents per population per generation.
+                Defaults to 1.
+        """
+        self.k = k
+
+    def opponents(self, g):
+        p = self.populations
+        k = min(self.k, p - 1)
+        offsets = [(g * k + r) % (p - 1) + 1 for r in range(k)]
+        return [[(i + o) % p for o in offsets] for i in range(p)]
+
+
+class RandomNeighbourSchedule(Schedule):
+    def __init__(self, k: int = 2, resample: bool = False):
+        """
+        Args:
+            k (int, optional): Neighbours of each population. Defaults to 2.
+            resample (bool, optional): Whether to draw new neighbours every
+                generation instead of once per run. Defaults to False.
+        """
+        self.k = k
+        self.resample = resample
+
+    def reset(self, populations, rng=None):
+        super().reset(populations, rng)
+        self._neighbours = self._draw()
+
+    def _draw(self) -> List[List[int]]:
+        p = self.populations
+        rng = resolve_rng(self.rng)
+        neighbours = []
+        for i in range(p):
+            js = rng.choice(p - 1, min(self.k, p - 1), replace=False)
+            neighbours += [[int(j + (j >= i)) for j in js]]
+        return neighbours
+
+    def opponents(self, g):
+        if self.resample and g > 0:
+            self._neighbours = self._draw()
+        return self._neighbours
+
+
+SCHEDULES = {
+    "full": FullSchedule,
+    "round_robin": RoundRobinSchedule,
+    "random": RandomNeighbourSchedule,
+}
+
+
+class MultiCoevolution(ArrayCoevolution):
+    SUBSTREAMS = ArrayCoevolution.SUBSTREAMS + ("schedule", "hof")
+
+    def __init__(
+        self,
+        scorer: Scorer = Scorer(intransitive=False),
+        selector: Selector = FitnessProportionateSelection(),
+        mutator: Mutator = Mutator(),
+        schedule: Union[str, Schedule] = "full",
+        hof: HOF = None,
+        rng: Union[int, np.random.Generator] = None,
+    ):
+        """Executor that coevolves N populations of the same shape held as
+        one (populations, n, traits) array. Each generation every scheduled
+        (population, opponent) pair is scored in one batched operation and
+        all populations are selected and mutated together.
+
+        Args:
+            scorer (Scorer, optional): Scorer for subjective fitness.
+            selector (Selector, optional): Selector for picking parents, see
+                `Selector.select_batch`.
+            mutator (Mutator, optional): Mutator for producing offspring.
+            schedule (Union[str, Schedule], optional): Interaction schedule,
+                or the name of one in `SCHEDULES`. Defaults to "full".
+            hof (HOF, optional): Hall of fame, each population gets its own,
+                see `BatchHOF`. Defaults to None.
+            rng (Union[int, np.random.Generator], optional): Root seed or
+                generator, see `Coevolution`. Defaults to None.
+        """
+        super().__init__(scorer, selector, mutator, hof, rng)
+        if isinstance(schedule, str):
+            schedule = SCHEDULES[schedule]()
+        self.schedule = schedule
+
+    def run(self, pops: List[Union[Population, ArrayPopulation]], generations: int):
+        """Run coevolution of the populations. Histories are stored as
+        arrays:
+
+            values  (generations + 1, populations, n, traits)
+            subj    (generations + 1, populations)
+
+        With a HOF, the halls of fame of every population are kept in the
+        `BatchHOF` `hofs`.
+
+        Args:
+            pops (List[Union[Population, ArrayPopulation]]): Initial
+                populations, all of the same size and generator.
+            generations (int): Number of generations to run for.
+        """
+        pops = [
+            p if isinstance(p, ArrayPopulation) else ArrayPopulation.from_population(p)
+            for p in pops
+        ]
+        self.total_bits = pops[0].total_bits_by_trait
+        initial = np.stack([p.values for p in pops])
+        self.values = np.empty((generations + 1,) + initial.shape, dtype=initial.dtype)
+        self.subj = np.empty((generations + 1, len(pops)))
+        self.values[0] = initial
+        self.schedule.reset(len(pops), self._rngs.get("schedule"))
+        self.hofs = BatchHOF.from_hof(self.hof, len(pops), self._rngs.get("hof"))
+        rows = np.arange(len(pops))
+        for g in range(generations + 1):
+            values = self.values[g]
+            f = self.assess_fitness(values, self.schedule.opponents(g))
+            self.subj[g] = f.mean(axis=-1)
+            if self.hofs is not None:
+                self.hofs.add(values[rows, np.argmax(f, axis=-1)])
+            if g == generations:
+                break
+            self.values[g + 1] = self.next_generation(values, f)
+
+    def assess_fitness(
+        self, values: np.ndarray, opponents: List[List[int]]
+    ) -> np.ndarray:
+        """Average subjective score of every individual against samples of
+        its opponent populations (and HOF). Samples from each opponent are
+        weighted equally, as samples of the population and HOF are weighted
+        in `Coevolution`.
+
+        Args:
+            values (np.ndarray): Unitations, (populations, n, traits).
+            opponents (List[List[int]]): Opponents of each population.
+
+        Returns:
+            np.ndarray: Subjective fitness, (populations, n).
+        """
+        p = len(values)
+        totals = np.zeros(values.shape[:2])
+        counts = np.zeros(p)
+        pairs = [(i, j) for (i, js) in enumerate(opponents) for j in js]
+        if pairs:
+            (src, dst) = np.array(pairs).T
+            # Every scheduled pair is scored in one broadcast operation
+            scores = self.scorer.subj_fitness_values(values[src], values[dst])
+            np.add.at(totals, src, scores.sum(axis=-1))
+            counts += np.bincount(src, minlength=p) * scores.shape[-1]
+        if self.hofs is not None:
+            scores = self.hofs.subj_fitness_values(values)
+            totals += scores.sum(axis=-1)
+            counts += scores.shape[-1]
+        counts = np.maximum(counts, 1)
+        return totals / counts[:, np.newaxis]
+
+    @property
+    def populations(self) -> int:
+        return self.subj.shape[1]
+
+    def pair(self, i: int, j: int) -> HistorySink:
+        """Get the history of two of the populations as if they were the A
+        and B populations of a `Coevolution` run, which can be plotted.
+
+        Args:
+            i (int): Index of the population plotted as A.
+            j (int): Index of the population plotted as B.
+
+        Returns:
+            HistorySink: History of array populations.
+        """
+        return self._history(
+            self.values[:, i], self.values[:, j], self.subj[:, i], self.subj[:, j]
+        )
@@ -4,36 +4,144 @@ Holds mutation class for mutating an individual.
 
 __authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
 
-import copy
-import random
+import numpy as np
 
-from representation import Individual
+from representation import Individual, ArrayPopulation, Trait
+from utils import resolve_rng
 
 
 class Mutator:
-    def __init__(self, mutation_rate: float = 0.005, bit_flip: bool = False):
+    def __init__(
+        self,
+        mutation_rate: float = 0.005,
+        bit_flip: bool = False,
+        batched: bool = True,
+        count_bits: bool = False,
+        rng: np.random.Generator = None,
+    ):
+        """
+        Args:
+            mutation_rate (float, optional): Probability of each bit mutating.
+                Defaults to 0.005.
+            bit_flip (bool, optional): Whether a mutated bit is flipped, if
+                not it is randomly reassigned. Defaults to False.
+            batched (bool, optional): Whether to draw the number of changed
+                bits of each trait from binomial distributions instead of
+                mutating bit by bit. Both give the same distribution but
+                batched mutation does not scale with the number of bits.
+                Defaults to True.
+            count_bits (bool, optional): Whether to keep a running count of
+                the bits changed in `bits_mutated`, e.g. for profiling.
+                Defaults to False.
+            rng (np.random.Generator, optional): Generator to draw from.
+                Defaults to the shared default generator.
+        """
         self.mutation_rate = mutation_rate
         self.bit_flip = bit_flip
+        self.batched = batched
+        self.count_bits = count_bits
+        self.rng = rng
+        # Running count of bits changed by mutation
+        self.bits_mutated = 0
 
     def mutate(self, i: Individual, inplace: bool = False) -> Individual:
+        """Mutate an individual. Unless mutating in place, the individual is
+        copied on write: if no trait changes the individual itself is
+        returned, otherwise a new individual is returned that shares the
+        unchanged traits. Traits must therefore never be modified, `inplace`
+        mutation replaces the changed traits of the individual instead.
+
+        Args:
+            i (Individual): The individual to mutate.
+            inplace (bool, optional): Whether to modify the individual
+                itself. Defaults to False.
+
+        Returns:
+            Individual: The mutated individual.
+        """
+        if self.batched:
+            values = self.mutate_values(
+                np.array(i.values), np.array(i.total_bits_by_trait)
+            ).tolist()
+        else:
+            values = [self._mutate_trait(t.value, t.total_bits) for t in i.traits]
+        if values == list(i.values):
+            return i
+        traits = []
+        for (t, value) in zip(i.traits, values):
+            traits += [t if value == t.value else Trait(value, t.total_bits)]
+        if inplace:
+            # Traits may be shared with the parent, so are not written to
+            i.traits = traits
+            return i
+        return Individual(traits)
+
+    def mutate_population(
+        self, pop: ArrayPopulation, inplace: bool = False
+    ) -> ArrayPopulation:
+        """Mutate every trait of every individual in an array population.
+
+        Args:
+            pop (ArrayPopulation): The population to mutate.
+            inplace (bool, optional): Whether to modify the population's
+                array directly. Defaults to False.
+
+        Returns:
+            ArrayPopulation: The mutated population.
+        """
         if not inplace:
-            i = copy.deepcopy(i)
-        for t in i.traits:
-            set_bits = t.value
-            unset_bits = t.total_bits - set_bits
-            t.value = 0
-            for b in range(set_bits):
-                t.value += self._mutate_bit(1)
-            for b in range(unset_bits):
-                t.value += self._mutate_bit(0)
-        return i
-
-    def _mutate_bit(self, bit_value: int) -> int:
-        if random.uniform(0, 1) > self.mutation_rate:
+            pop = pop.copy()
+        values = pop.values
+        total_bits = pop.total_bits_by_trait
+        if self.batched:
+            values[:] = self.mutate_values(values, total_bits)
+            return pop
+        for (idx, value) in np.ndenumerate(values):
+            values[idx] = self._mutate_trait(int(value), int(total_bits[idx[1]]))
+        return pop
+
+    def mutate_values(self, values: np.ndarray, total_bits: np.ndarray) -> np.ndarray:
+        """Mutate trait unitations in a single batch. A set bit is lost with
+        probability `mutation_rate` when bit flipping, or half that when
+        randomly reassigning, and an unset bit is gained likewise. The number
+        of bits lost and gained by each trait are therefore binomial.
+
+        Args:
+            values (np.ndarray): Unitations of any shape.
+            total_bits (np.ndarray): Total bits of each trait, broadcastable
+                against values.
+
+        Returns:
+            np.ndarray: The mutated unitations (a new array).
+        """
+        rng = resolve_rng(self.rng)
+        p = self.mutation_rate if self.bit_flip else self.mutation_rate / 2
+        lost = rng.binomial(values, p)
+        gained = rng.binomial(total_bits - values, p)
+        if self.count_bits:
+            self.bits_mutated += int(lost.sum() + gained.sum())
+        return values - lost + gained
+
+    def _mutate_trait(self, value: int, total_bits: int) -> int:
+        rng = resolve_rng(self.rng)
+        set_bits = value
+        unset_bits = total_bits - set_bits
+        value = 0
+        for b in range(set_bits):
+            value += self._mutate_bit(1, rng)
+        for b in range(unset_bits):
+            value += self._mutate_bit(0, rng)
+        return value
+
+    def _mutate_bit(self, bit_value: int, rng: np.random.Generator) -> int:
+        if rng.random() > self.mutation_rate:
             # No mutation
             return bit_value
         # Return new bit value
         if self.bit_flip:
-            return not bit_value
+            new_value = not bit_value
         else:
-            return random.choice([0, 1])
+            new_value = int(rng.integers(2))
+        if self.count_bits:
+            self.bits_mutated += new_value != bit_value
+        return new_value
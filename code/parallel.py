@@ -0,0 +1,250 @@
+"""COMP6202 - Evolution of Complexity
+Holds scorer wrapper [ParallelScorer] that splits fitness assessment of
+large populations into chunks of individuals scored on a thread or process
+pool. With processes the scored individuals and opponents (population or
+HOF) are written into a shared memory block that workers read in place, the
+block is kept between calls and only reallocated when it must grow.
+
+Pools and shared memory are released by `ParallelScorer.close` (or leaving a
+`with` block), by `shutdown_pools` for every scorer, or once the scorer is
+garbage collected.
+"""
+
+__authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
+
+import weakref
+import numpy as np
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Tuple, Union
+
+from representation import Population, ArrayPopulation
+from scoring import Scorer
+from utils import resolve_rng, with_rng
+
+BACKENDS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+# Resources of every scorer that has started a pool
+_OPEN = weakref.WeakSet()
+
+
+def shutdown_pools():
+    """Shut down the pools and free the shared memory of every scorer."""
+    for resources in list(_OPEN):
+        resources.close()
+
+
+class _Resources:
+    def __init__(self):
+        # Held apart from the scorer so they can be released once it is
+        # garbage collected
+        self.pool = None
+        self.shm = None
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def close_shm(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        self.close_pool()
+        self.close_shm()
+        _OPEN.discard(self)
+
+
+class ParallelScorer:
+    def __init__(
+        self,
+        scorer: Scorer,
+        workers: int = None,
+        chunk_size: int = 256,
+        backend: str = "thread",
+    ):
+        """Scorer that assesses chunks of `chunk_size` individuals in
+        parallel, otherwise behaving as the scorer it wraps. Each chunk
+        samples opponents from its own generator seeded from the wrapped
+        scorer's generator, so results only depend on the chunk size and
+        not on the number of workers or the order chunks finish in.
+
+        The pool is started on first use, process workers are sent the
+        wrapped scorer once when they start. Copies of the scorer start
+        their own pool.
+
+        Args:
+            scorer (Scorer): Scorer to parallelise.
+            workers (int, optional): Number of workers. Defaults to the
+                number of CPUs.
+            chunk_size (int, optional): Individuals per chunk. Defaults to
+                256.
+            backend (str, optional): "thread" or "process". Defaults to
+                "thread".
+        """
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend: {}".format(backend))
+        self._resources = _Resources()
+        self._finalizer = weakref.finalize(self, self._resources.close)
+        self.scorer = scorer
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.backend = backend
+
+    def __getattr__(self, name: str):
+        # Delegate everything else to the wrapped scorer
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.scorer, name)
+
+    def __copy__(self) -> "ParallelScorer":
+        return ParallelScorer(self.scorer, self.workers, self.chunk_size, self.backend)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_resources"], state["_finalizer"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._resources = _Resources()
+        self._finalizer = weakref.finalize(self, self._resources.close)
+
+    def __enter__(self) -> "ParallelScorer":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Shut down the pool and free the shared memory, both are started
+        again if the scorer is used after closing.
+        """
+        self._resources.close()
+
+    @property
+    def scorer(self) -> Scorer:
+        return self._scorer
+
+    @scorer.setter
+    def scorer(self, scorer: Scorer):
+        # Process workers hold the scorer they were started with
+        self._resources.close_pool()
+        self._scorer = scorer
+
+    @property
+    def rng(self) -> np.random.Generator:
+        return self.scorer.rng
+
+    @rng.setter
+    def rng(self, rng: np.random.Generator):
+        # Workers reseed the scorer for every chunk, so its pool is kept
+        self._scorer = with_rng(self.scorer, rng)
+
+    def _pool(self) -> Executor:
+        resources = self._resources
+        if resources.pool is None:
+            kwargs = {}
+            if self.backend == "process":
+                kwargs = dict(initializer=_init_worker, initargs=(self.scorer,))
+            resources.pool = BACKENDS[self.backend](max_workers=self.workers, **kwargs)
+            _OPEN.add(resources)
+        return resources.pool
+
+    def _shared(self, nbytes: int) -> shared_memory.SharedMemory:
+        resources = self._resources
+        if resources.shm is None or resources.shm.size < nbytes:
+            size = max(nbytes, 2 * resources.shm.size if resources.shm else 0)
+            resources.close_shm()
+            resources.shm = shared_memory.SharedMemory(create=True, size=size)
+            _OPEN.add(resources)
+        return resources.shm
+
+    def subj_fitness_population(
+        self, pop: ArrayPopulation, opponents: Union[ArrayPopulation, Population]
+    ) -> np.ndarray:
+        """See `Scorer.subj_fitness_population`."""
+        if len(opponents) == 0:
+            return np.zeros((len(pop), 0))
+        return self.subj_fitness_values(pop.values, Scorer._as_values(opponents))
+
+    def subj_fitness_values(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """See `Scorer.subj_fitness_values`, chunks are taken along the
+        individual axis of `a`.
+        """
+        n = a.shape[-2]
+        starts = range(0, n, self.chunk_size)
+        bounds = [(s, min(s + self.chunk_size, n)) for s in starts]
+        seeds = resolve_rng(self.rng).integers(2 ** 63, size=len(bounds))
+        if len(bounds) == 1:
+            return _score_chunk(self.scorer, a, b, bounds[0], seeds[0])
+        pool = self._pool()
+        if self.backend == "thread":
+            futures = [
+                pool.submit(_score_chunk, self.scorer, a, b, bound, seed)
+                for (bound, seed) in zip(bounds, seeds)
+            ]
+            return np.concatenate([f.result() for f in futures], axis=-2)
+        # Write both arrays into shared memory once for every chunk to read
+        dtype = np.dtype(ArrayPopulation.DTYPE)
+        shm = self._shared(int(np.prod(a.shape) + np.prod(b.shape)) * dtype.itemsize)
+        (shared_a, shared_b) = _shared_views(shm, a.shape, b.shape)
+        shared_a[...] = a
+        shared_b[...] = b
+        del shared_a, shared_b
+        futures = [
+            pool.submit(_score_shared_chunk, shm.name, a.shape, b.shape, bound, seed)
+            for (bound, seed) in zip(bounds, seeds)
+        ]
+        return np.concatenate([f.result() for f in futures], axis=-2)
+
+
+def _shared_views(
+    shm: shared_memory.SharedMemory, a_shape: tuple, b_shape: tuple
+) -> Tuple[np.ndarray, np.ndarray]:
+    dtype = ArrayPopulation.DTYPE
+    a = np.ndarray(a_shape, dtype=dtype, buffer=shm.buf)
+    b = np.ndarray(b_shape, dtype=dtype, buffer=shm.buf, offset=a.nbytes)
+    return (a, b)
+
+
+def _score_chunk(
+    scorer: Scorer,
+    a: np.ndarray,
+    b: np.ndarray,
+    bound: Tuple[int, int],
+    seed: int,
+) -> np.ndarray:
+    scorer = with_rng(scorer, np.random.default_rng(seed))
+    (start, stop) = bound
+    return np.array(scorer.subj_fitness_values(a[..., start:stop, :], b))
+
+
+# State of a process worker, set once when it starts
+_worker_scorer = None
+_worker_shm = None
+
+
+def _init_worker(scorer: Scorer):
+    global _worker_scorer
+    _worker_scorer = scorer
+
+
+def _score_shared_chunk(
+    shm_name: str,
+    a_shape: tuple,
+    b_shape: tuple,
+    bound: Tuple[int, int],
+    seed: int,
+) -> np.ndarray:
+    global _worker_shm
+    # Stay attached to the block until the scorer reallocates it
+    if _worker_shm is None or _worker_shm.name != shm_name:
+        if _worker_shm is not None:
+            _worker_shm.close()
+        _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    (a, b) = _shared_views(_worker_shm, a_shape, b_shape)
+    return _score_chunk(_worker_scorer, a, b, bound, seed)
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 """COMP6202 - Evolution of Complexity
 Plotting methods for coevolution report graphs.
 """
@@ -5,14 +7,98 @@ Plotting methods for coevolution report graphs.
 __authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
 
 import cv2 as cv
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 
-from typing import List
-from matplotlib.pyplot import figure
-from representation import Population
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Union
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from representation import Population, ArrayPopulation
 from coevolution import Coevolution
+from history import HistorySink, StatsSink
+
+
+class PlotData:
+    def __init__(
+        self,
+        gens: np.ndarray,
+        subj_a: np.ndarray,
+        subj_b: np.ndarray,
+        total_bits: int,
+        values_a: np.ndarray = None,
+        values_b: np.ndarray = None,
+        avgs_a: np.ndarray = None,
+        avgs_b: np.ndarray = None,
+    ):
+        """Array-form history of a run, holding only what is plotted. Either
+        the objective values of every individual or just their averages
+        must be given.
+
+        Args:
+            gens (np.ndarray): Generation numbers, (generations,).
+            subj_a (np.ndarray): Average subjective score of A, (generations,).
+            subj_b (np.ndarray): Average subjective score of B, (generations,).
+            total_bits (int): Total bits of an individual.
+            values_a (np.ndarray, optional): Objective values of A,
+                (generations, n). Defaults to None.
+            values_b (np.ndarray, optional): Objective values of B,
+                (generations, n). Defaults to None.
+            avgs_a (np.ndarray, optional): Average objective value of A,
+                defaults to the average of `values_a`.
+            avgs_b (np.ndarray, optional): Average objective value of B,
+                defaults to the average of `values_b`.
+        """
+        self.gens = np.asarray(gens)
+        self.subj_a = np.asarray(subj_a)
+        self.subj_b = np.asarray(subj_b)
+        self.total_bits = total_bits
+        self.values_a = values_a
+        self.values_b = values_b
+        self.avgs_a = values_a.mean(axis=1) if avgs_a is None else np.asarray(avgs_a)
+        self.avgs_b = values_b.mean(axis=1) if avgs_b is None else np.asarray(avgs_b)
+
+    @property
+    def has_raw(self) -> bool:
+        return self.values_a is not None
+
+    @classmethod
+    def from_history(
+        cls, history: Union[Coevolution, HistorySink, StatsSink]
+    ) -> PlotData:
+        """Extract plot data from a run, a sink or a run archive."""
+        if hasattr(history, "gens"):
+            gens = np.array(history.gens)
+        else:
+            gens = np.arange(len(history.subj_a))
+        if not hasattr(history, "pops_a"):
+            # Statistics only
+            return cls(
+                gens,
+                history.subj_a,
+                history.subj_b,
+                history.total_bits,
+                avgs_a=history.mean_a,
+                avgs_b=history.mean_b,
+            )
+        if isinstance(getattr(history, "values_a", None), np.ndarray):
+            # Unitations of every generation are already one array
+            values_a = history.values_a.sum(axis=-1)
+            values_b = history.values_b.sum(axis=-1)
+        else:
+            values_a = np.array([pop.value for pop in history.pops_a])
+            values_b = np.array([pop.value for pop in history.pops_b])
+        total_bits = history.pops_a[-1][0].total_bits
+        return cls(
+            gens,
+            history.subj_a,
+            history.subj_b,
+            total_bits,
+            values_a=values_a,
+            values_b=values_b,
+        )
 
 
 class Plotter:
@@ -29,62 +115,129 @@ class Plotter:
             self.b_color = self.b_avg_color
 
     def make_plot(
-        self, coevolution: Coevolution, fig_name: str = None, export_path: str = None
-    ) -> figure:
-        # Prepare data
-        generations = len(coevolution.pops_a)
-        total_bits = coevolution.pops_a[-1][0].total_bits
-        avgs_x = range(generations)
-        raw_x, a_raw, b_raw, a_avgs, b_avgs = ([] for i in range(5))
-        for g in range(generations):
-            pop_a = list(map(lambda x: x.value, coevolution.pops_a[g]))
-            pop_b = list(map(lambda x: x.value, coevolution.pops_b[g]))
-            # X axis
-            raw_x += [g] * len(pop_b)
-            # Append raw data
-            a_raw += pop_a
-            b_raw += pop_b
-            # Record averages
-            a_avgs += [np.mean(pop_a)]
-            b_avgs += [np.mean(pop_b)]
+        self,
+        coevolution: Union[Coevolution, HistorySink, StatsSink],
+        fig_name: str = None,
+        export_path: str = None,
+    ) -> Figure:
+        """Plot objective and subjective fitness over a run in a pyplot
+        figure (shown by `plt.show()`).
+
+        Args:
+            coevolution (Union[Coevolution, HistorySink, StatsSink]): A run
+                with its full history, or a sink that a run was streamed to.
+                Only averages are plotted from a `StatsSink`.
+            fig_name (str, optional): Name of the figure. Defaults to None.
+            export_path (str, optional): Path to save the figure to.
+                Defaults to None.
 
+        Returns:
+            Figure: The plotted figure.
+        """
+        data = PlotData.from_history(coevolution)
         # Use LaTeX fonts in the plot
         plt.rc("text", usetex=True)
         plt.rc("font", family="serif")
 
         w, h = plt.figaspect(0.88)
         fig = plt.figure(fig_name, figsize=(w, h))
+        self.draw(fig, data, usetex=True)
+        # Export
+        if export_path:
+            Plotter._export(fig, export_path)
+
+        # Plot elites
+        if self.show_elite_plots and hasattr(coevolution, "pops_a"):
+            self.plot_elites(fig_name + "- Elites [A]", coevolution.pops_a)
+            self.plot_elites(fig_name + "- Elites [B]", coevolution.pops_b)
+        return fig
+
+    def render(
+        self,
+        history: Union[PlotData, Coevolution, HistorySink, StatsSink],
+        export_path: str = None,
+        usetex: bool = False,
+    ) -> Figure:
+        """Headless equivalent of `make_plot`. The figure is drawn with the
+        object-oriented Agg API so no pyplot state is used and rendering is
+        safe in worker processes.
+
+        Args:
+            history (Union[PlotData, Coevolution, HistorySink, StatsSink]):
+                Array-form plot data, or anything `make_plot` accepts.
+            export_path (str, optional): Path to save the figure to.
+                Defaults to None.
+            usetex (bool, optional): Whether to render text with LaTeX, which
+                requires a LaTeX install. Defaults to False.
+
+        Returns:
+            Figure: The plotted figure.
+        """
+        if not isinstance(history, PlotData):
+            history = PlotData.from_history(history)
+        w, h = plt.figaspect(0.88)
+        fig = Figure(figsize=(w, h))
+        FigureCanvasAgg(fig)
+        with matplotlib.rc_context({"text.usetex": usetex, "font.family": "serif"}):
+            self.draw(fig, history, usetex=usetex)
+            if export_path:
+                Plotter._export(fig, export_path)
+        return fig
+
+    def draw(self, fig: Figure, data: PlotData, usetex: bool = False):
+        """Draw objective and subjective fitness plots into a figure.
+
+        Args:
+            fig (Figure): The figure to draw into.
+            data (PlotData): The run to draw.
+            usetex (bool, optional): Whether labels use LaTeX formatting.
+                Defaults to False.
+        """
+
+        def label(text: str) -> Tuple[str, dict]:
+            # Bold label text and font properties
+            if usetex:
+                return (r"\textbf{" + text + "}", {"fontsize": 11})
+            return (text, {"fontsize": 11, "fontweight": "bold"})
+
+        avgs_x = data.gens
+        generations = avgs_x[-1] + 1
         ax = fig.subplots(3, 1, sharex=True, gridspec_kw={"height_ratios": [16, 1, 1]})
         fig.subplots_adjust(hspace=0.11)
         # Fix all x axis limits (shared axis)
-        ax[0].set_xlim([0, generations])
+        ax[0].set_xlim([avgs_x[0], generations])
 
         # Configure Objective Score Plot
-        plt.subplot(ax[0])
-        ax[0].set_ylim([0, total_bits])
+        ax[0].set_ylim([0, data.total_bits])
         ax[0].tick_params(
             axis="x", which="both", bottom=False, top=False, labelbottom=False
         )
-        ax[0].set_ylabel(r"\textbf{objectv fitness}", fontsize=11)
+        ax[0].set_ylabel(*label("objectv fitness"))
         ax[0].spines["right"].set_visible(False)
-        plt.hlines(total_bits / 2, 0, generations, colors="black", linewidth=1)
+        ax[0].hlines(
+            data.total_bits / 2, avgs_x[0], generations, colors="black", linewidth=1
+        )
 
         # Plot Raw
-        plt.scatter(raw_x, a_raw, s=1, c=self.a_color, alpha=1, lw=0)
-        plt.scatter(raw_x, b_raw, s=1, c=self.b_color, alpha=1, lw=0)
+        if data.has_raw:
+            raw_x = np.repeat(avgs_x, data.values_b.shape[1])
+            ax[0].scatter(
+                raw_x, data.values_a.ravel(), s=1, c=self.a_color, alpha=1, lw=0
+            )
+            ax[0].scatter(
+                raw_x, data.values_b.ravel(), s=1, c=self.b_color, alpha=1, lw=0
+            )
         # Plot Averages
-        if self.show_avgs:
-            plt.plot(a_avgs, c=self.a_avg_color, lw=1)
-            plt.plot(b_avgs, c=self.b_avg_color, lw=1)
+        if self.show_avgs or not data.has_raw:
+            ax[0].plot(avgs_x, data.avgs_a, c=self.a_avg_color, lw=1)
+            ax[0].plot(avgs_x, data.avgs_b, c=self.b_avg_color, lw=1)
 
         # Make a legend
-        plt.plot([], [], c=self.a_avg_color, label="$P_A$")
-        plt.plot([], [], c=self.b_avg_color, label="$P_B$")
-        plt.legend()
+        ax[0].plot([], [], c=self.a_avg_color, label="$P_A$")
+        ax[0].plot([], [], c=self.b_avg_color, label="$P_B$")
+        ax[0].legend()
         # Plot Subjective Score (A)
-        plt.subplot(ax[1])
-        plt.scatter(avgs_x, coevolution.subj_a, c=self.a_avg_color, s=2)
-        plt.setp(ax[1].get_xticklabels(), visible=False)
+        ax[1].scatter(avgs_x, data.subj_a, c=self.a_avg_color, s=2)
         ax[1].set_ylim([0, 1])
         ax[1].spines["bottom"].set_visible(False)
         ax[1].spines["right"].set_visible(False)
@@ -93,40 +246,127 @@ class Plotter:
             axis="x", which="both", bottom=False, top=False, labelbottom=False
         )
         # Plot Subjective Score (B)
-        plt.subplot(ax[2], sharey=ax[1])
-        plt.scatter(avgs_x, coevolution.subj_b, c=self.b_avg_color, s=2)
-        ax[2].set_xlabel(r"\textbf{Generations}", fontsize=11)
+        ax[2].sharey(ax[1])
+        ax[2].scatter(avgs_x, data.subj_b, c=self.b_avg_color, s=2)
+        ax[2].set_xlabel(*label("Generations"))
         ax[2].set_ylim([0, 1])
-        ax[2].figure.text(
-            0.05, 0.2, r"\textbf{subj fitness}", fontsize=11, va="center", rotation=90,
-        )
+        fig.text(0.05, 0.2, *label("subj fitness"), va="center", rotation=90)
         ax[2].spines["right"].set_visible(False)
         ax[2].spines["top"].set_visible(False)
 
-        # Plot elites
-        if self.show_elite_plots:
-            self.plot_elites(fig_name + "- Elites [A]", coevolution.pops_a)
-            self.plot_elites(fig_name + "- Elites [B]", coevolution.pops_b)
+    @staticmethod
+    def _export(fig: Figure, export_path: str):
+        folder_path = "/".join(export_path.split("/")[0:-1])
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+        fig.savefig(export_path, bbox_inches="tight", dpi=300)
 
-        # Export
+    def plot_elites(
+        self,
+        fig_name: str,
+        pops: Union[List[Union[Population, ArrayPopulation]], np.ndarray],
+        total_bits: np.ndarray = None,
+        export_path: str = None,
+        show: bool = True,
+    ) -> np.ndarray:
+        """Plot the bits of the elite of each generation, one row per
+        generation.
+
+        Args:
+            fig_name (str): Name of the window.
+            pops (Union[List[Union[Population, ArrayPopulation]], np.ndarray]):
+                Population of each generation, or unitations of every
+                generation as a (generations, n, traits) array.
+            total_bits (np.ndarray, optional): Total bits of each trait,
+                required if unitations are given. Defaults to None.
+            export_path (str, optional): Path to write the bitmap image to.
+                Defaults to None.
+            show (bool, optional): Whether to show the bitmap in a window.
+                Defaults to True.
+
+        Returns:
+            np.ndarray: The (unscaled) bitmap.
+        """
+        if isinstance(pops, np.ndarray):
+            values = pops
+        else:
+            values = np.array([pop.values for pop in pops])
+            total_bits = pops[-1][0].total_bits_by_trait
+        # First individual with the maximum value is the elite
+        elite_idxs = np.argmax(values.sum(axis=-1), axis=1)
+        elites = values[np.arange(len(values)), elite_idxs]
+        bitmap = Plotter.elite_bitmap(elites, total_bits).astype(float)
+        show_bitmap = cv.resize(
+            bitmap, (0, 0), fx=7.5, fy=0.25, interpolation=cv.INTER_NEAREST
+        )
         if export_path:
-            folder_path = "/".join(export_path.split("/")[0:-1])
+            folder_path = os.path.dirname(export_path)
             if folder_path and not os.path.exists(folder_path):
                 os.makedirs(folder_path)
-            fig.savefig(export_path, bbox_inches="tight", dpi=300)
-        return fig
+            cv.imwrite(export_path, (show_bitmap * 255).astype(np.uint8))
+        if show:
+            cv.imshow(fig_name, show_bitmap)
+        return bitmap
 
-    def plot_elites(self, fig_name: str, pops: List[Population]):
-        elites = [max(pop, key=lambda x: x.value) for pop in pops]
-        bitmap = None
-        for elite in elites:
-            bits = elite.as_bits()
-            if bitmap is None:
-                bitmap = bits
-            else:
-                bitmap = np.vstack((bitmap, elite.as_bits()))
-        bitmap = bitmap.astype(float)
-        show_bitmap = cv.resize(
-            bitmap, (0, 0), fx=7.5, fy=0.25, interpolation=cv.INTER_NEAREST
+    @staticmethod
+    def elite_bitmap(elites: np.ndarray, total_bits: np.ndarray) -> np.ndarray:
+        """Expand unitations to bits, with the set bits of each trait first
+        (see `Individual.as_bits`).
+
+        Args:
+            elites (np.ndarray): Unitations with shape (generations, traits).
+            total_bits (np.ndarray): Total bits of each trait.
+
+        Returns:
+            np.ndarray: Boolean bitmap with shape (generations, total bits).
+        """
+        total_bits = np.asarray(total_bits)
+        if np.all(total_bits == total_bits[0]):
+            # Broadcast every trait against a single bit position range
+            positions = np.arange(total_bits[0])
+            bits = positions < elites[:, :, np.newaxis]
+            return bits.reshape(len(elites), -1)
+        return np.hstack(
+            [np.arange(b) < elites[:, [t]] for (t, b) in enumerate(total_bits)]
         )
-        cv.imshow(fig_name, show_bitmap)
+
+
+def render_many(
+    jobs: List[Tuple[Union[PlotData, HistorySink], str]],
+    plotter: Plotter = None,
+    processes: int = None,
+    usetex: bool = False,
+) -> List[str]:
+    """Render many figures headlessly across a process pool. Histories are
+    reduced to `PlotData` before being sent to the workers.
+
+    Args:
+        jobs (List[Tuple[Union[PlotData, HistorySink], str]]): History and
+            export path of each figure.
+        plotter (Plotter, optional): Plotter to render with. Defaults to a
+            default `Plotter`.
+        processes (int, optional): Number of worker processes, 1 renders in
+            this process. Defaults to the number of CPUs.
+        usetex (bool, optional): See `Plotter.render`. Defaults to False.
+
+    Returns:
+        List[str]: The export paths, in job order.
+    """
+    plotter = plotter if plotter is not None else Plotter()
+    jobs = [(plotter, _plot_data(h), path, usetex) for (h, path) in jobs]
+    if processes == 1:
+        return list(map(_render_job, jobs))
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_render_job, jobs))
+
+
+def _plot_data(history: Union[PlotData, HistorySink]) -> PlotData:
+    if isinstance(history, PlotData):
+        return history
+    return PlotData.from_history(history)
+
+
+def _render_job(job: Tuple[Plotter, PlotData, str, bool]) -> str:
+    (plotter, data, export_path, usetex) = job
+    plotter.render(data, export_path=export_path, usetex=usetex)
+    return export_path
@@ -0,0 +1,110 @@
+"""COMP6202 - Evolution of Complexity
+Holds per-phase timing and counting instrumentation for coevolution runs.
+"""
+
+__authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
+
+import json
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+
+class Profiler:
+    # Whether anything is recorded, work only done to be counted can be
+    # skipped if not
+    enabled = True
+
+    def __init__(self, trace: bool = False):
+        """Collects cumulative time spent in each phase of a run and counts
+        of the work done.
+
+        Args:
+            trace (bool, optional): Whether to also keep the phase times and
+                counts of every generation. Defaults to False.
+        """
+        self.trace = trace
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.generations = []
+        self._generation = None
+
+    def start_generation(self, g: int):
+        if self.trace:
+            self._generation = {"generation": g, "times": {}, "counts": {}}
+            self.generations += [self._generation]
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.times[name] += elapsed
+            self.calls[name] += 1
+            if self._generation is not None:
+                times = self._generation["times"]
+                times[name] = times.get(name, 0) + elapsed
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] += value
+        if self._generation is not None:
+            counts = self._generation["counts"]
+            counts[name] = counts.get(name, 0) + value
+
+    def report(self) -> dict:
+        """Structured report of the collected timings and counters."""
+        total = sum(self.times.values())
+        phases = {}
+        for (name, elapsed) in self.times.items():
+            phases[name] = {
+                "total": elapsed,
+                "calls": self.calls[name],
+                "mean": elapsed / self.calls[name],
+                "fraction": elapsed / total if total else 0,
+            }
+        report = {"phases": phases, "counters": dict(self.counters)}
+        if self.trace:
+            report["trace"] = self.generations
+        return report
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def __str__(self) -> str:
+        lines = []
+        for (name, stats) in self.report()["phases"].items():
+            lines += [
+                "{:<12} {:>10.4f}s {:>6.1%} ({} calls)".format(
+                    name, stats["total"], stats["fraction"], stats["calls"]
+                )
+            ]
+        for (name, value) in self.counters.items():
+            lines += ["{:<12} {:>10}".format(name, value)]
+        return "\n".join(lines)
+
+
+class NullProfiler(Profiler):
+    """Profiler that records nothing, used when profiling is off.
+    """
+
+    enabled = False
+
+    def __init__(self):
+        super().__init__()
+
+    def start_generation(self, g: int):
+        pass
+
+    def phase(self, name: str):
+        return _NULL_CONTEXT
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+
+_NULL_CONTEXT = nullcontext()
@@ -2,11 +2,14 @@ from __future__ import annotations
 
 """COMP6202 - Evolution of Complexity
 
-Holds individual representation and population holder.
+Holds individual representation and population holders.
 """
 
+import weakref
+import numpy as np
+
 from collections import UserList
-from typing import List, Tuple
+from typing import List, Tuple, Union
 
 
 class Generator:
@@ -23,39 +26,288 @@ class Generator:
     def population(self, n: int, value: int) -> Population:
         return Population([self.individual(value)] * n)
 
+    def array_population(self, n: int, value: int) -> ArrayPopulation:
+        if value > self.trait_bits or value < 0:
+            raise ValueError("Value > total_bits or < 0")
+        values = np.full((n, self.trait_count), value, dtype=ArrayPopulation.DTYPE)
+        total_bits = np.full(self.trait_count, self.trait_bits)
+        return ArrayPopulation(values, total_bits)
+
 
 class Population(UserList):
     """ Populations are just lists of individuals.
+
+    Aggregates of the individuals' values are computed lazily and cached
+    until the list or any of its individuals change.
     """
 
     def __init__(self, elements: List[Individual] = [], **kwargs):
+        self._cache = {}
         super().__init__(elements, **kwargs)
 
+    def _invalidate(self):
+        self._cache.clear()
+
+    def _cached(self, key: str, compute) -> np.ndarray:
+        if key not in self._cache:
+            if not self._cache:
+                # Watch for changes to the individuals from now on, lists
+                # are unhashable so are held by id
+                for i in self.data:
+                    i._watch(self)
+            result = compute()
+            if isinstance(result, np.ndarray):
+                result.flags.writeable = False
+            self._cache[key] = result
+        return self._cache[key]
+
+    @property
+    def values(self) -> np.ndarray:
+        """Unitations of each individual's traits, shape (n, trait_count)."""
+        return self._cached("values", lambda: np.array([i.values for i in self]))
+
+    @property
+    def value(self) -> np.ndarray:
+        """Objective value of each individual, shape (n,)."""
+        return self._cached("value", lambda: np.array([i.value for i in self]))
+
+    @property
+    def mean_value(self) -> float:
+        return self._cached("mean_value", lambda: np.mean(self.value))
+
+    @property
+    def max_value(self) -> int:
+        return self._cached("max_value", lambda: np.max(self.value))
+
+    @property
+    def argmax_value(self) -> int:
+        return self._cached("argmax_value", lambda: np.argmax(self.value))
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_cache"] = {}
+        return state
+
+    def __copy__(self) -> Population:
+        # UserList copies __dict__, which would share the cache
+        pop = super().__copy__()
+        pop._cache = {}
+        return pop
+
+    # Every method that changes the list drops the cached aggregates
+
+    def __setitem__(self, i, item):
+        super().__setitem__(i, item)
+        self._invalidate()
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self._invalidate()
+
+    def __iadd__(self, other):
+        result = super().__iadd__(other)
+        self._invalidate()
+        return result
+
+    def __imul__(self, n):
+        result = super().__imul__(n)
+        self._invalidate()
+        return result
+
+    def append(self, item):
+        super().append(item)
+        self._invalidate()
+
+    def insert(self, i, item):
+        super().insert(i, item)
+        self._invalidate()
+
+    def pop(self, i=-1):
+        self._invalidate()
+        return super().pop(i)
+
+    def remove(self, item):
+        super().remove(item)
+        self._invalidate()
+
+    def clear(self):
+        super().clear()
+        self._invalidate()
+
+    def reverse(self):
+        super().reverse()
+        self._invalidate()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._invalidate()
+
+    def extend(self, other):
+        super().extend(other)
+        self._invalidate()
+
+
+class ArrayPopulation:
+    """Compact population that holds the unitation of every trait of every
+    individual in a single (n, trait_count) integer array. The total number
+    of bits of each trait is tracked once for the whole population.
+
+    Indexing with an integer returns a standalone `Individual` so that code
+    written against `Population` keeps working, indexing with a slice or an
+    index array returns a new `ArrayPopulation`.
+    """
+
+    DTYPE = np.int32
+
+    def __init__(self, values: np.ndarray, total_bits: np.ndarray):
+        """
+        Args:
+            values (np.ndarray): Unitations with shape (n, trait_count).
+            total_bits (np.ndarray): Total bits of each trait with shape
+                (trait_count,).
+        """
+        values = np.asarray(values, dtype=ArrayPopulation.DTYPE)
+        total_bits = np.asarray(total_bits, dtype=ArrayPopulation.DTYPE)
+        if values.ndim != 2 or values.shape[1:] != total_bits.shape:
+            raise ValueError("Values must have shape (n, len(total_bits))")
+        if np.any(values > total_bits) or np.any(values < 0):
+            raise ValueError("Value > total_bits or < 0")
+        self._values = values
+        self._total_bits = total_bits
+
+    @classmethod
+    def from_population(cls, pop: Population) -> ArrayPopulation:
+        if len(pop) == 0:
+            raise ValueError("Cannot infer trait sizes from an empty population")
+        values = [i.values for i in pop]
+        return cls(values, pop[0].total_bits_by_trait)
+
+    def to_population(self) -> Population:
+        return Population([self[i] for i in range(len(self))])
+
+    @property
+    def values(self) -> np.ndarray:
+        """Unitations of each individual's traits, shape (n, trait_count)."""
+        return self._values
+
+    @property
+    def value(self) -> np.ndarray:
+        """Objective value of each individual, shape (n,)."""
+        return self._values.sum(axis=1)
+
+    @property
+    def total_bits_by_trait(self) -> np.ndarray:
+        return self._total_bits
+
+    @property
+    def total_bits(self) -> int:
+        return int(self._total_bits.sum())
+
+    @property
+    def trait_count(self) -> int:
+        return len(self._total_bits)
+
+    def take(self, idxs: Union[List[int], np.ndarray]) -> ArrayPopulation:
+        """Create a new population from the individuals at the given indexes,
+        repeats are allowed.
+        """
+        idxs = np.asarray(idxs, dtype=int)
+        return ArrayPopulation(self._values[idxs], self._total_bits)
+
+    def copy(self) -> ArrayPopulation:
+        return ArrayPopulation(self._values.copy(), self._total_bits)
+
+    def individual(self, idx: int) -> Individual:
+        traits = []
+        for (value, total_bits) in zip(self._values[idx], self._total_bits):
+            traits += [Trait(int(value), int(total_bits))]
+        return Individual(traits)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __getitem__(self, idx) -> Union[Individual, ArrayPopulation]:
+        if isinstance(idx, (int, np.integer)):
+            return self.individual(idx)
+        return ArrayPopulation(self._values[idx], self._total_bits)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.individual(i)
+
+    def __repr__(self) -> str:
+        return str(self._values.tolist())
+
 
 class Individual:
     def __init__(self, traits: List[Trait]):
-        """[summary]
+        """Individual made up of traits. Derived values are computed once
+        and cached until a trait changes, traits notify the individuals that
+        hold them. Replace traits by assigning `traits` rather than by
+        changing the list in place.
 
         Args:
-            traits (List[Trait]): [description]
+            traits (List[Trait]): The traits of the individual.
         """
+        self._owners = None
         self.traits = traits
 
+    @property
+    def traits(self) -> List[Trait]:
+        return self._traits
+
+    @traits.setter
+    def traits(self, traits: List[Trait]):
+        self._traits = traits
+        for t in traits:
+            t._watch(self)
+        self._invalidate()
+
+    def _invalidate(self):
+        self._values = None
+        self._value = None
+        self._total_bits_by_trait = None
+        self._total_bits = None
+        if self._owners is not None:
+            self._owners.invalidate()
+
+    def _watch(self, owner: Population):
+        if self._owners is None:
+            self._owners = _Owners()
+        self._owners.add(owner)
+
     @property
     def values(self) -> Tuple[int]:
-        return tuple(map(lambda x: x.value, self.traits))
+        if self._values is None:
+            self._values = tuple([t.value for t in self._traits])
+        return self._values
 
     @property
     def value(self) -> int:
-        return sum(self.values)
+        if self._value is None:
+            self._value = sum(self.values)
+        return self._value
 
     @property
     def total_bits_by_trait(self) -> Tuple[int]:
-        return tuple(map(lambda x: x.total_bits, self.traits))
+        if self._total_bits_by_trait is None:
+            self._total_bits_by_trait = tuple([t.total_bits for t in self._traits])
+        return self._total_bits_by_trait
 
     @property
     def total_bits(self) -> int:
-        return sum(self.total_bits_by_trait)
+        if self._total_bits is None:
+            self._total_bits = sum(self.total_bits_by_trait)
+        return self._total_bits
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_owners"] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.traits = self._traits
 
     def as_bits(self):
         bits = []
@@ -78,8 +330,10 @@ class Trait:
         """
         if value > total_bits or value < 0:
             raise ValueError("Value > total_bits or < 0")
+        # Individuals holding the trait, told when it changes
+        self._owners = None
         self._value = value
-        self.total_bits = total_bits
+        self._total_bits = total_bits
 
     @property
     def value(self) -> int:
@@ -87,10 +341,60 @@ class Trait:
 
     @value.setter
     def value(self, value: int):
-        self._value = max(0, min(value, self.total_bits))
+        self._value = max(0, min(value, self._total_bits))
+        self._changed()
+
+    @property
+    def total_bits(self) -> int:
+        return self._total_bits
+
+    @total_bits.setter
+    def total_bits(self, total_bits: int):
+        self._total_bits = total_bits
+        self._changed()
+
+    def _changed(self):
+        if self._owners is not None:
+            self._owners.invalidate()
+
+    def _watch(self, owner: Individual):
+        if self._owners is None:
+            self._owners = _Owners()
+        self._owners.add(owner)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_owners"] = None
+        return state
 
     def as_bits(self):
         return [1] * self.value + [0] * (self.total_bits - self.value)
 
     def __repr__(self) -> str:
         return str(self.value)
+
+
+class _Owners:
+    """Weakly held owners of an object, e.g. the individuals holding a trait,
+    whose cached values are invalidated when the object changes. Traits can
+    be shared by many short lived individuals so dead owners are dropped
+    whenever the number held doubles.
+    """
+
+    __slots__ = ("refs", "limit")
+
+    def __init__(self):
+        self.refs = {}
+        self.limit = 8
+
+    def add(self, owner):
+        if len(self.refs) >= self.limit:
+            self.refs = {k: r for (k, r) in self.refs.items() if r() is not None}
+            self.limit = max(8, 2 * len(self.refs))
+        self.refs[id(owner)] = weakref.ref(owner)
+
+    def invalidate(self):
+        for ref in list(self.refs.values()):
+            owner = ref()
+            if owner is not None:
+                owner._invalidate()
@@ -0,0 +1,147 @@
+"""COMP6202 - Evolution of Complexity
+Holds experiment description [Experiment] and a process pool runner for
+executing many jobs, e.g. (experiment, seed) runs, in parallel.
+"""
+
+__authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
+
+import random
+import sys
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List
+
+from archive import ArchiveSink
+from coevolution import Coevolution
+from history import Sink
+from representation import Generator
+
+
+class Experiment:
+    def __init__(
+        self,
+        name: str,
+        generator: Generator,
+        generations: int,
+        n: int = 25,
+        init_a: int = 0,
+        init_b: int = 0,
+        seed: int = None,
+        export_name: str = None,
+        **kwargs
+    ):
+        """Description of a single coevolution run that can be executed in a
+        worker process.
+
+        Args:
+            name (str): Name used to describe the experiment.
+            generator (Generator): Generator for both populations.
+            generations (int): Number of generations to run for.
+            n (int, optional): Population size. Defaults to 25.
+            init_a (int, optional): Initial trait value of population A.
+                Defaults to 0.
+            init_b (int, optional): Initial trait value of population B.
+                Defaults to 0.
+            seed (int, optional): Fixed seed of the experiment, a random seed
+                is drawn if not provided. Defaults to None.
+            export_name (str, optional): File name to export the plot as.
+                Defaults to None.
+            **kwargs: Arguments used to construct the `Coevolution`.
+        """
+        self.name = name
+        self.generator = generator
+        self.generations = generations
+        self.n = n
+        self.init_a = init_a
+        self.init_b = init_b
+        self.seed = seed
+        self.export_name = export_name
+        self.coevolution_kwargs = kwargs
+
+    def seeds(self, count: int = 1) -> List[int]:
+        """Get the seeds to run the experiment with. A single run uses the
+        experiment's seed directly, multiple runs use independent seeds
+        spawned from it.
+
+        Args:
+            count (int, optional): Number of runs. Defaults to 1.
+
+        Returns:
+            List[int]: A seed for each run.
+        """
+        seed = self.seed
+        if seed is None:
+            seed = random.randrange(sys.maxsize)
+        if count == 1:
+            return [seed]
+        return spawn_seeds(seed, count)
+
+    def describe(self, seed: int) -> str:
+        return "{} : [Seed {}]".format(self.name, seed)
+
+    def metadata(self, seed: int) -> dict:
+        """JSON serialisable description of a run of the experiment."""
+        components = {}
+        for (k, v) in self.coevolution_kwargs.items():
+            if isinstance(v, list):
+                components[k] = [type(c).__name__ for c in v]
+            else:
+                components[k] = type(v).__name__
+        return {
+            "name": self.name,
+            "seed": seed,
+            "trait_bits": self.generator.trait_bits,
+            "trait_count": self.generator.trait_count,
+            "init_a": self.init_a,
+            "init_b": self.init_b,
+            "components": components,
+        }
+
+    def archive_sink(self, path: str, seed: int) -> ArchiveSink:
+        """Make a sink that archives a run of the experiment to a folder."""
+        total_bits = [self.generator.trait_bits] * self.generator.trait_count
+        return ArchiveSink(
+            path, self.generations, self.n, total_bits, self.metadata(seed)
+        )
+
+    def run(self, seed: int, sinks: List[Sink] = None) -> Coevolution:
+        pop_a = self.generator.array_population(self.n, self.init_a)
+        pop_b = self.generator.array_population(self.n, self.init_b)
+        executor = Coevolution(rng=seed, **self.coevolution_kwargs)
+        executor.run(pop_a, pop_b, self.generations, sinks=sinks)
+        return executor
+
+
+def spawn_seeds(seed: int, count: int) -> List[int]:
+    """Spawn independent child seeds from a root seed.
+
+    Args:
+        seed (int): The root seed.
+        count (int): Number of child seeds.
+
+    Returns:
+        List[int]: The child seeds.
+    """
+    children = np.random.SeedSequence(seed).spawn(count)
+    return [int(c.generate_state(1, np.uint64)[0]) for c in children]
+
+
+def map_jobs(fn: Callable, jobs: List, processes: int = None) -> List:
+    """Run a job function on every job, spreading them across a process
+    pool. Jobs must draw from generators spawned from their own seeds so
+    they are independent of each other and of the order they execute in.
+
+    Args:
+        fn (Callable): Picklable function run on each job.
+        jobs (List): The jobs.
+        processes (int, optional): Number of worker processes, 1 runs
+            in this process. Defaults to the number of CPUs.
+
+    Returns:
+        List: Result of each job, in order.
+    """
+    if processes == 1 or not jobs:
+        return list(map(fn, jobs))
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(fn, jobs))
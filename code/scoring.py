@@ -5,26 +5,52 @@ Holds subjective scoring classes: Scorer, F0Scorer.
 __authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
 
 import operator
-import random
+import numpy as np
 
-from typing import List
-from representation import Population, Individual
+from typing import List, Sequence, Union
+from representation import Population, ArrayPopulation, Individual
+from utils import resolve_rng
 
 
 class Scorer:
     """Scorer that implements `score2` and `score3`.
     """
 
-    def __init__(self, sample_size: int = 15, intransitive: bool = False):
+    def __init__(
+        self,
+        sample_size: int = 15,
+        intransitive: bool = False,
+        exact: bool = False,
+        rng: np.random.Generator = None,
+    ):
+        """
+        Args:
+            sample_size (int, optional): Number of opponents sampled per
+                individual. Defaults to 15.
+            intransitive (bool, optional): Whether to use `score3` (traits
+                closest) instead of `score2` (traits furthest apart).
+                Defaults to False.
+            exact (bool, optional): Whether to score each individual by its
+                exact mean score against every opponent instead of sampling
+                opponents, see `win_rates`. Defaults to False.
+            rng (np.random.Generator, optional): Generator used for sampling
+                opponents. Defaults to the module-level generator.
+        """
         if intransitive:
             self.op = operator.lt
         else:
             self.op = operator.gt
+        self.intransitive = intransitive
         self.sample_size = sample_size
+        self.exact = exact
+        self.rng = rng
 
     def score(self, a: Individual, b: Individual) -> int:
-        a = a.values
-        b = b.values
+        return self.score_values(a.values, b.values)
+
+    def score_values(self, a: Sequence[int], b: Sequence[int]) -> int:
+        """Score two individuals given as the unitations of their traits.
+        """
         mi = 0
         for (i, (ta, tb)) in enumerate(zip(a, b)):
             delta = abs(tb - ta)
@@ -36,6 +62,107 @@ class Scorer:
     def _score(a: int, b: int) -> int:
         return 1 if a > b else 0
 
+    def score_arrays(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Vectorised `score_values` for arrays of unitations. The trait
+        axis is the last axis, all other axes are broadcast. Ties between
+        traits are broken towards the first trait, same as `score_values`.
+
+        Args:
+            a (np.ndarray): Unitations of the scored individuals.
+            b (np.ndarray): Unitations of the opponents.
+
+        Returns:
+            np.ndarray: Score of each broadcast pairing (0 or 1).
+        """
+        a, b = np.broadcast_arrays(a, b)
+        delta = np.abs(a - b)
+        if self.intransitive:
+            mi = np.argmin(delta, axis=-1)
+        else:
+            mi = np.argmax(delta, axis=-1)
+        mi = mi[..., np.newaxis]
+        ta = np.take_along_axis(a, mi, axis=-1)[..., 0]
+        tb = np.take_along_axis(b, mi, axis=-1)[..., 0]
+        return (ta > tb).astype(int)
+
+    def score_matrix(
+        self,
+        pop_a: Union[ArrayPopulation, np.ndarray],
+        pop_b: Union[ArrayPopulation, np.ndarray],
+    ) -> np.ndarray:
+        """Score every individual of one population against every individual
+        of another. Unitation arrays may have leading batch axes, e.g.
+        (replicates, n, trait_count), which are broadcast.
+
+        Args:
+            pop_a (Union[ArrayPopulation, np.ndarray]): Scored population,
+                or its (..., n, trait_count) unitations.
+            pop_b (Union[ArrayPopulation, np.ndarray]): Opponent population,
+                or its (..., m, trait_count) unitations.
+
+        Returns:
+            np.ndarray: Win matrix with shape (..., n, m), where [i, j] is
+                the score of a[i] against b[j].
+        """
+        a = Scorer._as_values(pop_a)
+        b = Scorer._as_values(pop_b)
+        return self.score_arrays(a[..., :, np.newaxis, :], b[..., np.newaxis, :, :])
+
+    def sample_score_matrix(self, matrix: np.ndarray) -> np.ndarray:
+        """Sample `sample_size` opponents for each row of a win matrix, with
+        repeats allowed (same as applet).
+
+        Args:
+            matrix (np.ndarray): Win matrix with shape (..., n, m).
+
+        Returns:
+            np.ndarray: Sampled scores with shape (..., n, sample size).
+        """
+        size = matrix.shape[:-1] + (self.sample_size,)
+        idxs = resolve_rng(self.rng).integers(matrix.shape[-1], size=size)
+        return np.take_along_axis(matrix, idxs, axis=-1)
+
+    def win_rates(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Exact mean score of every individual against every opponent, the
+        expectation of the sampled scores. Leading batch axes are broadcast.
+        Single trait unitations are ranked by sorting the opponents instead
+        of building the full win matrix.
+
+        Args:
+            a (np.ndarray): Scored unitations, (..., n, trait_count).
+            b (np.ndarray): Opponent unitations, (..., m, trait_count).
+
+        Returns:
+            np.ndarray: Win rates with shape (..., n).
+        """
+        if a.shape[-1] == 1:
+            return Scorer._win_rates_sorted(a[..., 0], b[..., 0])
+        return self.score_matrix(a, b).mean(axis=-1)
+
+    @staticmethod
+    def _win_rates_sorted(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        batch = np.broadcast_shapes(a.shape[:-1], b.shape[:-1])
+        (n, m) = (a.shape[-1], b.shape[-1])
+        a = np.broadcast_to(a, batch + (n,)).reshape(-1, n)
+        b = np.broadcast_to(b, batch + (m,)).reshape(-1, m)
+        # Offset each row past the previous so a single search of the
+        # flattened rows only counts opponents in the same row
+        span = int(max(a.max(), b.max())) + 1
+        offsets = np.arange(len(a))[:, np.newaxis] * span
+        b_sorted = (np.sort(b, axis=-1) + offsets).ravel()
+        # Opponents with a strictly lower unitation are beaten
+        wins = np.searchsorted(b_sorted, (a + offsets).ravel(), side="left")
+        wins = wins.reshape(a.shape) - np.arange(len(a))[:, np.newaxis] * m
+        return (wins / m).reshape(batch + (n,))
+
+    @staticmethod
+    def _as_values(pop: Union[ArrayPopulation, Population, np.ndarray]) -> np.ndarray:
+        if isinstance(pop, np.ndarray):
+            return pop
+        if not isinstance(pop, ArrayPopulation):
+            pop = ArrayPopulation.from_population(pop)
+        return pop.values
+
     def subj_fitness(self, a: Individual, pop: Population) -> List[int]:
         """Calculate the subjective fitness for an individual using an
         opponent population.
@@ -50,9 +177,71 @@ class Scorer:
         """
         if len(pop) == 0:
             return []
+        if self.exact:
+            rate = np.mean([self.score(a, b) for b in pop])
+            return [rate] * self.sample_size
         # Allow repeats, same as applet
-        pop = random.choices(pop, k=self.sample_size)
-        return list(map(lambda b: self.score(a, b), pop))
+        idxs = resolve_rng(self.rng).integers(len(pop), size=self.sample_size)
+        return list(map(lambda idx: self.score(a, pop[idx]), idxs))
+
+    def subj_fitness_population(
+        self, pop: ArrayPopulation, opponents: Union[ArrayPopulation, Population]
+    ) -> np.ndarray:
+        """Calculate the subjective fitness samples of every individual in an
+        array population, see `subj_fitness`.
+
+        Args:
+            pop (ArrayPopulation): The individuals to score.
+            opponents (Union[ArrayPopulation, Population]): The population to
+                select opponents from.
+
+        Returns:
+            np.ndarray: Scores with shape (n, sample size), or (n, 0) if there
+                are no opponents.
+        """
+        if len(opponents) == 0:
+            return np.zeros((len(pop), 0))
+        return self.subj_fitness_values(pop.values, Scorer._as_values(opponents))
+
+    def subj_fitness_values(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Calculate subjective fitness samples from unitation arrays, see
+        `subj_fitness_population`. Leading batch axes are broadcast.
+
+        Args:
+            a (np.ndarray): Scored unitations, (..., n, trait_count).
+            b (np.ndarray): Opponent unitations, (..., m, trait_count).
+
+        Returns:
+            np.ndarray: Scores with shape (..., n, sample size). In exact
+                mode each row repeats the win rate so populations and HOFs
+                keep the same weighting as when sampled.
+        """
+        if self.exact:
+            rates = self.win_rates(a, b)[..., np.newaxis]
+            return np.broadcast_to(rates, rates.shape[:-1] + (self.sample_size,))
+        return self.score_arrays(a[..., :, np.newaxis, :], self.sample_opponents(a, b))
+
+    def sample_opponents(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Sample `sample_size` opponents for each scored individual, with
+        repeats allowed (same as applet). Only the sampled pairs are scored,
+        so the full win matrix is never built. Draws the same indexes as
+        `sample_score_matrix` on the equivalent win matrix.
+
+        Args:
+            a (np.ndarray): Scored unitations, (..., n, trait_count).
+            b (np.ndarray): Opponent unitations, (..., m, trait_count).
+
+        Returns:
+            np.ndarray: Sampled opponent unitations with shape
+                (..., n, sample size, trait_count).
+        """
+        batch = np.broadcast_shapes(a.shape[:-2], b.shape[:-2])
+        (n, (m, t)) = (a.shape[-2], b.shape[-2:])
+        size = batch + (n, self.sample_size)
+        idxs = resolve_rng(self.rng).integers(m, size=size)
+        b = np.broadcast_to(b, batch + (m, t))
+        flat = idxs.reshape(batch + (-1, 1))
+        return np.take_along_axis(b, flat, axis=-2).reshape(size + (t,))
 
 
 class F0Scorer(Scorer):
@@ -61,3 +250,9 @@ class F0Scorer(Scorer):
 
     def subj_fitness(self, *args) -> int:
         return 0
+
+    def subj_fitness_population(self, pop: ArrayPopulation, *args) -> np.ndarray:
+        return np.zeros((len(pop), 1))
+
+    def subj_fitness_values(self, a: np.ndarray, *args) -> np.ndarray:
+        return np.zeros(a.shape[:-1] + (1,))
@@ -5,106 +5,334 @@ Holds different selection classes.
 
 __authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
 
-import random
 import numpy as np
 
-from typing import List
+from typing import List, Union
+from utils import resolve_rng, with_rng
 
 DEFAULT_BIAS = 0.000001
 
 
 class Selector:
-    def select(self, fs: List[float], k: int = None) -> List[int]:
+    def select(
+        self, fs: List[float], k: int = None, as_array: bool = False
+    ) -> Union[List[int], np.ndarray]:
         pass
 
+    def select_batch(self, fs: np.ndarray, k: int = None) -> np.ndarray:
+        """Select from many independent populations at once.
+
+        Args:
+            fs (np.ndarray): Fitnesses with shape (replicates, n).
+            k (int, optional): Number of selections from each population.
+                Defaults to n.
+
+        Returns:
+            np.ndarray: Selected indexes with shape (replicates, k).
+        """
+        return np.array([self.select(f, k, as_array=True) for f in fs])
+
+    @staticmethod
+    def _search_rows(wheels: np.ndarray, picks: np.ndarray) -> np.ndarray:
+        # Search each row's wheel in one call by normalising the wheels to
+        # [0, 1] and offsetting each row so they do not overlap
+        (r, n) = wheels.shape
+        totals = wheels[:, -1:]
+        # A wheel with no fitness picks its first slot, as `select` does
+        totals = np.where(totals > 0, totals, 1)
+        offsets = 2 * np.arange(r)[:, np.newaxis]
+        flat = np.searchsorted(
+            (wheels / totals + offsets).ravel(), (picks / totals + offsets).ravel()
+        )
+        selected = flat.reshape(picks.shape) - offsets // 2 * n
+        return np.minimum(selected, n - 1)
+
+    @staticmethod
+    def _result(
+        selected: Union[List[int], np.ndarray], as_array: bool
+    ) -> Union[List[int], np.ndarray]:
+        if as_array:
+            return np.asarray(selected, dtype=int)
+        return np.asarray(selected).tolist()
+
+    @staticmethod
+    def _wheel(fs: List[float], bias: float) -> np.ndarray:
+        return np.cumsum(np.asarray(fs, dtype=float) + bias, axis=-1)
+
 
 class FitnessProportionateSelection(Selector):
-    def __init__(self, bias: float = DEFAULT_BIAS):
+    def __init__(self, bias: float = DEFAULT_BIAS, rng: np.random.Generator = None):
         self.bias = bias
+        self.rng = rng
 
-    def select(self, fs: List[float], k: int = None) -> List[int]:
+    def select(
+        self, fs: List[float], k: int = None, as_array: bool = False
+    ) -> Union[List[int], np.ndarray]:
         if not k:
             k = len(fs)
         # Make wheel
-        total = 0
-        wheel = []
-        for f in fs:
-            total += f + self.bias
-            wheel += [total]
-        # Spin wheel
-        selected = []
-        for s in range(k):
-            i = 0
-            pick = random.random() * total
-            while wheel[i] < pick:
-                i += 1
-            selected += [i]
-        return selected
+        wheel = Selector._wheel(fs, self.bias)
+        # Spin wheel, first slot that reaches each pick
+        picks = resolve_rng(self.rng).random(k) * wheel[-1]
+        selected = np.searchsorted(wheel, picks, side="left")
+        return Selector._result(selected, as_array)
+
+    def select_batch(self, fs: np.ndarray, k: int = None) -> np.ndarray:
+        wheels = Selector._wheel(fs, self.bias)
+        (r, n) = wheels.shape
+        picks = resolve_rng(self.rng).random((r, k or n)) * wheels[:, -1:]
+        return Selector._search_rows(wheels, picks)
 
 
 class StochasticUniversalSampling(Selector):
-    def __init__(self, bias: float = DEFAULT_BIAS):
+    def __init__(self, bias: float = DEFAULT_BIAS, rng: np.random.Generator = None):
         self.bias = bias
+        self.rng = rng
 
-    def select(self, fs: List[float], k: int = None) -> List[int]:
+    def select(
+        self, fs: List[float], k: int = None, as_array: bool = False
+    ) -> Union[List[int], np.ndarray]:
         if not k:
             k = len(fs)
-
         # Make wheel
-        total = 0
-        wheel = []
-        for f in fs:
-            total += f + self.bias
-            wheel += [total]
+        wheel = Selector._wheel(fs, self.bias)
         # Make pointers
-        dist = total / k
-        start = random.random() * dist
-        pointers = [start + i * dist for i in range(k)]
-        # Select
-        selected = []
-        for p in pointers:
-            i = 0
-            while wheel[i] < p:
-                i += 1
-            selected += [i]
-        return selected
+        dist = wheel[-1] / k
+        start = resolve_rng(self.rng).random() * dist
+        pointers = start + np.arange(k) * dist
+        # Select, pointers are sorted so merge them with the wheel by
+        # counting the pointers that fall in each slot
+        counts = np.searchsorted(pointers, wheel, side="right")
+        counts[-1] = k
+        counts = np.diff(counts, prepend=0)
+        selected = np.repeat(np.arange(len(wheel)), counts)
+        return Selector._result(selected, as_array)
+
+    def select_batch(self, fs: np.ndarray, k: int = None) -> np.ndarray:
+        wheels = Selector._wheel(fs, self.bias)
+        (r, n) = wheels.shape
+        k = k or n
+        dist = wheels[:, -1:] / k
+        starts = resolve_rng(self.rng).random((r, 1)) * dist
+        pointers = starts + np.arange(k) * dist
+        return Selector._search_rows(wheels, pointers)
 
 
 class TournamentSelection(Selector):
-    def __init__(self, n: int):
+    def __init__(self, n: int, replace: bool = True, rng: np.random.Generator = None):
+        """
+        Args:
+            n (int): Number of competitors in each tournament.
+            replace (bool, optional): Whether competitors are drawn with
+                replacement, i.e. an individual can meet itself. Defaults to
+                True.
+            rng (np.random.Generator, optional): Generator to draw from.
+                Defaults to the shared default generator.
+        """
         self.n = n
+        self.replace = replace
+        self.rng = rng
 
-    def select(self, fs: List[float], k: int = None) -> List[int]:
+    def select(
+        self, fs: List[float], k: int = None, as_array: bool = False
+    ) -> Union[List[int], np.ndarray]:
         if not k:
             k = len(fs)
-        selected = []
-        for s in range(k):
-            tournament = random.choices(list(enumerate(fs)), k=self.n)
-            winner = max(tournament, key=lambda x: x[1])
-            selected += [winner[0]]
-        return selected
+        fs = np.asarray(fs)
+        rng = resolve_rng(self.rng)
+        # Draw every tournament at once, one per row
+        if self.replace:
+            tournaments = rng.integers(len(fs), size=(k, self.n))
+        else:
+            if self.n > len(fs):
+                raise ValueError("Tournament size > population size")
+            tournaments = self._draw_distinct(rng, len(fs), (k,))
+        # First competitor with the maximum fitness wins
+        winners = np.argmax(fs[tournaments], axis=1)
+        selected = tournaments[np.arange(k), winners]
+        return Selector._result(selected, as_array)
+
+    def select_batch(self, fs: np.ndarray, k: int = None) -> np.ndarray:
+        fs = np.asarray(fs)
+        (r, n) = fs.shape
+        k = k or n
+        rng = resolve_rng(self.rng)
+        if self.replace:
+            tournaments = rng.integers(n, size=(r, k, self.n))
+        else:
+            if self.n > n:
+                raise ValueError("Tournament size > population size")
+            tournaments = self._draw_distinct(rng, n, (r, k))
+        rows = np.arange(r)[:, np.newaxis, np.newaxis]
+        winners = np.argmax(fs[rows, tournaments], axis=-1)[..., np.newaxis]
+        return np.take_along_axis(tournaments, winners, axis=-1)[..., 0]
+
+    def _draw_distinct(
+        self, rng: np.random.Generator, n: int, shape: tuple
+    ) -> np.ndarray:
+        # Tournaments of distinct competitors, with shape shape + (self.n,)
+        tournaments = np.empty(shape + (self.n,), dtype=np.int64)
+        flat = tournaments.reshape(-1, self.n)
+        if self.n * self.n > n:
+            # Large tournaments collide too often to redraw, so draw them
+            # with Floyd's algorithm then shuffle each one
+            for (c, j) in enumerate(range(n - self.n, n)):
+                picks = rng.integers(j + 1, size=len(flat))
+                seen = np.any(flat[:, :c] == picks[:, np.newaxis], axis=-1)
+                flat[:, c] = np.where(seen, j, picks)
+            return rng.permuted(tournaments, axis=-1)
+        # Draw every tournament, then redraw those with repeated competitors
+        # until there are none
+        repeated = np.arange(len(flat))
+        while len(repeated):
+            flat[repeated] = rng.integers(n, size=(len(repeated), self.n))
+            ordered = np.sort(flat[repeated], axis=-1)
+            clash = np.any(ordered[:, 1:] == ordered[:, :-1], axis=-1)
+            repeated = repeated[clash]
+        return tournaments
+
+
+class Transform:
+    """Array-in/array-out fitness transform of a `SelectionPipeline`. The
+    population axis is the last axis, all other axes (e.g. replicates) are
+    transformed independently.
+    """
+
+    def __call__(self, fs: np.ndarray) -> np.ndarray:
+        """Transform fitnesses.
+
+        Args:
+            fs (np.ndarray): Fitnesses with shape (..., n).
+
+        Returns:
+            np.ndarray: Transformed fitnesses with the same shape.
+        """
+        pass
+
+
+class Normalise(Transform):
+    """Scale each population's fitnesses to [0, 1], populations where every
+    fitness is equal become all 0.
+    """
+
+    def __call__(self, fs):
+        fs = fs - fs.min(axis=-1, keepdims=True)
+        mx = fs.max(axis=-1, keepdims=True)
+        return np.divide(fs, mx, out=fs, where=mx > 0)
+
+
+class Virulence(Transform):
+    def __init__(self, lamb: Union[float, np.ndarray]):
+        """Reduced virulence, f' = 2f / λ - f² / λ², for fitnesses in [0, 1].
+
+        Args:
+            lamb (Union[float, np.ndarray]): Virulence λ, or one λ per
+                replicate with shape (replicates,) to sweep λ in one batch.
+        """
+        self.lamb = lamb
+
+    def __call__(self, fs):
+        la = np.asarray(self.lamb, dtype=float)
+        if la.ndim:
+            la = la[..., np.newaxis]
+        return 2 * fs / la - np.square(fs) / (la * la)
+
+
+class RankScaling(Transform):
+    def __init__(self, pressure: float = 2.0):
+        """Linear ranking, fitnesses are replaced by their rank scaled from
+        2 - pressure (worst) to pressure (best). Ties are ranked in order.
+
+        Args:
+            pressure (float, optional): Selection pressure in [1, 2].
+                Defaults to 2.
+        """
+        self.pressure = pressure
+
+    def __call__(self, fs):
+        n = fs.shape[-1]
+        ranks = np.argsort(np.argsort(fs, axis=-1, kind="stable"), axis=-1)
+        s = self.pressure
+        return (2 - s) + 2 * (s - 1) * ranks / max(n - 1, 1)
+
+
+class Bias(Transform):
+    def __init__(self, bias: float = DEFAULT_BIAS):
+        """Add a constant so no individual has zero chance of selection.
+
+        Args:
+            bias (float, optional): The bias. Defaults to DEFAULT_BIAS.
+        """
+        self.bias = bias
+
+    def __call__(self, fs):
+        return fs + self.bias
+
+
+class SelectionPipeline(Selector):
+    def __init__(self, transforms: List[Transform], selector: Selector):
+        """Selector that applies a chain of fitness transforms to arrays of
+        fitnesses then samples with a vectorised selector, e.g.
+
+            SelectionPipeline([Normalise(), Virulence(0.75)], SUS())
+
+        Args:
+            transforms (List[Transform]): Transforms in the order applied.
+            selector (Selector): Selector sampling the transformed fitnesses.
+        """
+        self.transforms = transforms
+        self.selector = selector
+
+    @property
+    def rng(self) -> np.random.Generator:
+        return self.selector.rng
+
+    @rng.setter
+    def rng(self, rng: np.random.Generator):
+        # Wrapped selectors may be shared so draw using a copy
+        self.selector = with_rng(self.selector, rng)
+
+    def transform(self, fs: Union[List[float], np.ndarray]) -> np.ndarray:
+        fs = np.array(fs, dtype=float)
+        for transform in self.transforms:
+            fs = transform(fs)
+        return fs
+
+    def select(
+        self, fs: List[float], k: int = None, as_array: bool = False
+    ) -> Union[List[int], np.ndarray]:
+        return self.selector.select(self.transform(fs), k, as_array=as_array)
+
+    def select_batch(self, fs: np.ndarray, k: int = None) -> np.ndarray:
+        return self.selector.select_batch(self.transform(fs), k)
+
 
+class VirulenceSelector(SelectionPipeline):
+    def __init__(
+        self,
+        selector: Selector,
+        lamb: Union[float, np.ndarray],
+        normalise: bool = True,
+    ):
+        """Pipeline of normalisation and reduced virulence, see `Virulence`.
 
-class VirulenceSelector(Selector):
-    def __init__(self, selector: Selector, lamb: float, normalise: bool = True):
+        Args:
+            selector (Selector): Selector sampling the transformed fitnesses.
+            lamb (Union[float, np.ndarray]): Virulence λ, or one per
+                replicate for `select_batch`.
+            normalise (bool, optional): Whether to normalise fitnesses to
+                [0, 1] first. Defaults to True.
+        """
         self.selector = selector
         self.do_normalise = normalise
         self.lamb = lamb
 
-    def select(self, fs: List[float], k: int = None) -> List[int]:
-        fs = np.array(fs)
-        if self.do_normalise:
-            fs = VirulenceSelector.normalise(fs)
-        la = self.lamb
-        fs = 2 * fs / la - np.square(fs) / (la * la)
-        # Use base selection scheme
-        return self.selector.select(fs, k)
+    @property
+    def transforms(self) -> List[Transform]:
+        # Built from the attributes so they can be changed between runs
+        transforms = [Normalise()] if self.do_normalise else []
+        return transforms + [Virulence(self.lamb)]
 
     @staticmethod
-    def normalise(vals: List[float]):
-        mi = min(vals)
-        vals = vals - mi
-        mx = max(vals)
-        if mx > 0:
-            vals = vals / mx
-        return vals
+    def normalise(vals: List[float]) -> np.ndarray:
+        return Normalise()(np.array(vals, dtype=float))
@@ -0,0 +1,182 @@
+"""COMP6202 - Evolution of Complexity
+Holds stopping criteria for ending a coevolution run early once its outcome
+is decided: Disengagement, Convergence, Cycling.
+
+Criteria are updated once per generation with the same arguments as a sink
+and keep their own rolling window, so they work on streamed runs too.
+"""
+
+__authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
+
+import numpy as np
+
+from collections import deque
+from typing import Union
+
+from representation import Population, ArrayPopulation
+
+
+class StoppingCriterion:
+    name = "criterion"
+
+    def __init__(self, window: int):
+        """
+        Args:
+            window (int): Number of generations of rolling statistics kept.
+        """
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        """Clear the rolling statistics, called at the start of every run."""
+        self.history = deque(maxlen=self.window)
+
+    def update(
+        self,
+        g: int,
+        pop_a: Union[Population, ArrayPopulation],
+        pop_b: Union[Population, ArrayPopulation],
+        subj_a: float,
+        subj_b: float,
+    ) -> bool:
+        """Update the rolling statistics with a generation of a run.
+
+        Args:
+            g (int): The generation number.
+            pop_a (Union[Population, ArrayPopulation]): Population A.
+            pop_b (Union[Population, ArrayPopulation]): Population B.
+            subj_a (float): Average subjective score of population A.
+            subj_b (float): Average subjective score of population B.
+
+        Returns:
+            bool: Whether the run should stop.
+        """
+        pass
+
+    @staticmethod
+    def _mean_values(
+        pop_a: Union[Population, ArrayPopulation],
+        pop_b: Union[Population, ArrayPopulation],
+    ) -> np.ndarray:
+        # Average objective value of each trait of both populations
+        values = (np.asarray(pop_a.values), np.asarray(pop_b.values))
+        return np.concatenate([v.mean(axis=0) for v in values])
+
+
+class Disengagement(StoppingCriterion):
+    name = "disengagement"
+
+    def __init__(self, window: int = 50, tolerance: float = 0.0):
+        """Stop once both populations' average subjective scores have been
+        at 0 or 1 for `window` generations in a row, i.e. one population
+        wins (or loses) every contest and selection has no gradient.
+
+        Args:
+            window (int, optional): Generations in a row. Defaults to 50.
+            tolerance (float, optional): Distance from 0 or 1 still counted
+                as disengaged, e.g. for scores including HOF contests.
+                Defaults to 0.
+        """
+        self.tolerance = tolerance
+        super().__init__(window)
+
+    def update(self, g, pop_a, pop_b, subj_a, subj_b):
+        disengaged = all(min(s, 1 - s) <= self.tolerance for s in (subj_a, subj_b))
+        self.history += [disengaged]
+        return len(self.history) == self.window and all(self.history)
+
+
+class Convergence(StoppingCriterion):
+    name = "convergence"
+
+    def __init__(self, window: int = 100, tolerance: float = 0.5):
+        """Stop once the average objective value of every trait of both
+        populations has stayed within `tolerance` over `window` generations.
+
+        Args:
+            window (int, optional): Generations to look back over.
+                Defaults to 100.
+            tolerance (float, optional): Largest change in average unitation
+                still counted as converged. Defaults to 0.5.
+        """
+        self.tolerance = tolerance
+        super().__init__(window)
+
+    def update(self, g, pop_a, pop_b, subj_a, subj_b):
+        self.history += [self._mean_values(pop_a, pop_b)]
+        if len(self.history) < self.window:
+            return False
+        values = np.array(self.history)
+        spread = values.max(axis=0) - values.min(axis=0)
+        return bool(np.all(spread <= self.tolerance))
+
+
+class Cycling(StoppingCriterion):
+    name = "cycling"
+
+    def __init__(
+        self,
+        window: int = 200,
+        threshold: float = 0.8,
+        min_period: int = 10,
+        min_spread: float = 5.0,
+        interval: int = 10,
+    ):
+        """Stop once the average objective values of both populations are
+        periodic. The autocorrelation of the values over the window must dip
+        below zero and then recover to at least `threshold` at some lag (the
+        period), which rules out trends and drift.
+
+        Args:
+            window (int, optional): Generations to look back over, the
+                longest detectable period is half of it. Defaults to 200.
+            threshold (float, optional): Autocorrelation at the period
+                needed to count as cycling. Defaults to 0.8.
+            min_period (int, optional): Shortest period considered.
+                Defaults to 10.
+            min_spread (float, optional): Smallest range of average
+                unitation over the window, so noise about a fixed point is
+                not counted as cycling. Defaults to 5.
+            interval (int, optional): Generations between checks, the
+                statistics are still updated every generation. Defaults to
+                10.
+        """
+        self.threshold = threshold
+        self.min_period = min_period
+        self.min_spread = min_spread
+        self.interval = interval
+        super().__init__(window)
+
+    def update(self, g, pop_a, pop_b, subj_a, subj_b):
+        self.history += [self._mean_values(pop_a, pop_b)]
+        if len(self.history) < self.window or g % self.interval:
+            return False
+        values = np.array(self.history)
+        if np.max(values.max(axis=0) - values.min(axis=0)) < self.min_spread:
+            return False
+        corr = Cycling.autocorrelation(values, self.window // 2)
+        troughs = np.flatnonzero(corr < 0)
+        if len(troughs) == 0:
+            return False
+        # Peak after the first trough is the period
+        start = max(troughs[0], self.min_period)
+        return bool(np.max(corr[start:], initial=-1) >= self.threshold)
+
+    @staticmethod
+    def autocorrelation(values: np.ndarray, max_lag: int) -> np.ndarray:
+        """Autocorrelation of a multivariate series, pooled over variables.
+
+        Args:
+            values (np.ndarray): Series with shape (length, variables).
+            max_lag (int): Largest lag.
+
+        Returns:
+            np.ndarray: Autocorrelation at lags 0 to `max_lag` inclusive.
+        """
+        x = values - values.mean(axis=0)
+        corr = np.ones(max_lag + 1)
+        for lag in range(1, max_lag + 1):
+            (head, tail) = (x[:-lag], x[lag:])
+            norm = np.sqrt(np.sum(head * head) * np.sum(tail * tail))
+            corr[lag] = np.sum(head * tail) / norm if norm else 0
+        return corr
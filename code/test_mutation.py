@@ -0,0 +1,25 @@
+"""COMP6202 - Evolution of Complexity
+Tests of mutation.
+"""
+
+__authors__ = "David Jones <dsj1n15@ecs.soton.ac.uk>"
+
+import numpy as np
+
+from history import HistorySink
+from mutation import Mutator
+from representation import Generator, Individual
+
+
+def test_inplace_mutate_leaves_parent_unchanged():
+    generator = Generator(100, 5)
+    parent = generator.individual(50)
+    history = HistorySink()
+    history.record(0, [parent], [parent], 0.5, 0.5)
+    mutator = Mutator(mutation_rate=0.5, rng=np.random.default_rng(0))
+    # As after copy on write, the child shares the parent's traits
+    child = Individual(list(parent.traits))
+    mutator.mutate(child, inplace=True)
+    assert child.values != (50,) * 5
+    assert parent.values == (50,) * 5
+    assert [t.value for t in history.pops_a[0][0].traits] == [50] * 5
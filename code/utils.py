@@ -1,10 +1,59 @@
+import copy
 import random
+import numpy as np
+
+from typing import Any, List, Union
+
+_default_rng = np.random.default_rng()
 
 
 def seed_random(seed: int, use_fixed: bool) -> int:
+    global _default_rng
     if not use_fixed:
         import sys  # noqa
 
         seed = random.randrange(sys.maxsize)
     random.seed(seed)
+    _default_rng = np.random.default_rng(seed)
     return seed
+
+
+def resolve_rng(rng: np.random.Generator = None) -> np.random.Generator:
+    """Get the generator to draw from, the shared default generator (seeded
+    by `seed_random`) is used if one has not been injected.
+    """
+    if rng is None:
+        return _default_rng
+    return rng
+
+
+def make_rng(seed: Union[int, np.random.Generator] = None) -> np.random.Generator:
+    """Make a generator from a seed, generators are passed through."""
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+
+def spawn_rngs(
+    seed: Union[int, np.random.Generator], n: int
+) -> List[np.random.Generator]:
+    """Spawn independent generators for sub-streams of a run. The same root
+    seed always spawns the same sub-streams.
+
+    Args:
+        seed (Union[int, np.random.Generator]): Root seed or generator.
+        n (int): Number of generators to spawn.
+
+    Returns:
+        List[np.random.Generator]: The spawned generators.
+    """
+    return make_rng(seed).spawn(n)
+
+
+def with_rng(obj: Any, rng: np.random.Generator) -> Any:
+    """Make a shallow copy of a component that draws from the given
+    generator, so components shared between runs are not modified.
+    """
+    obj = copy.copy(obj)
+    obj.rng = rng
+    return obj